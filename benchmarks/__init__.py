@@ -0,0 +1,21 @@
+"""
+Benchmarks for ClassyPie, covering every break algorithm and the
+split, unique, membership, rescale, assign and Classifier operations,
+across data sizes, value distributions and engines.
+
+Run from the repository root with:
+
+    python -m benchmarks
+    python -m benchmarks --sizes 1000 100000 10000000 --engines numpy
+    python -m benchmarks --save baseline.json
+    python -m benchmarks --compare baseline.json
+
+Reports the wall time, peak memory (measured with tracemalloc in a
+separate run) and throughput of each case. With --compare, cases that are
+slower than the saved baseline by more than the threshold are flagged and
+the exit code is 1.
+"""
+
+from .datasets import DISTRIBUTIONS, make_values
+from .cases import CASES
+from .runner import run, save, compare
@@ -0,0 +1,44 @@
+"""
+Command line entry point, see `python -m benchmarks --help`.
+"""
+
+from __future__ import print_function
+import argparse
+import sys
+
+import classypie.breaks
+
+from . import run, save, compare, DISTRIBUTIONS, CASES
+
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmark ClassyPie.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="numbers of values to benchmark, eg 1000 ... 10000000")
+    parser.add_argument("--distributions", nargs="+", default=sorted(DISTRIBUTIONS), choices=sorted(DISTRIBUTIONS))
+    parser.add_argument("--engines", nargs="+", default=None, choices=["python", "numpy"],
+                        help="defaults to python, plus numpy if installed")
+    parser.add_argument("--cases", nargs="+", default=None, choices=[name for name,_,_ in CASES])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the best time is kept")
+    parser.add_argument("--save", metavar="PATH", help="save the results as a json baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare the results to a saved json baseline")
+    parser.add_argument("--threshold", type=float, default=1.2, help="time ratio above which a case is flagged as slower")
+    opts = parser.parse_args(args)
+
+    engines = opts.engines
+    if not engines:
+        engines = ["python"]
+        if sys.modules["classypie.breaks"].get_engine() == "numpy":
+            engines.append("numpy")
+
+    results = run(opts.sizes, opts.distributions, engines, cases=opts.cases, repeat=opts.repeat)
+    if opts.save:
+        save(results, opts.save)
+    if opts.compare:
+        if compare(results, opts.compare, threshold=opts.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
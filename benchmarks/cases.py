@@ -0,0 +1,73 @@
+"""
+The benchmark cases. Each case is a function that takes the list of values
+and the engine name, and runs the operation to completion.
+"""
+
+import classypie as cp
+
+
+
+ALGORITHMS = ("equal", "quantile", "pretty", "stdev", "natural", "headtail", "log")
+
+def _breaks_case(algorithm):
+    def case(values, engine):
+        cp.breaks(values, algorithm, classes=5, engine=engine)
+    case.__name__ = "breaks_%s" % algorithm
+    return case
+
+def _fixed_breaks(values):
+    return cp.breaks(values, "equal", classes=5, engine="python")
+
+def split_sorted(values, engine):
+    for valrange,members in cp.split(values, _fixed_breaks(values)):
+        pass
+
+def split_unsorted(values, engine):
+    for valrange,members in cp.split(values, _fixed_breaks(values), sort=False):
+        pass
+
+def assign(values, engine):
+    cp.assign(values, _fixed_breaks(values), engine=engine)
+
+def summarize(values, engine):
+    cp.summarize(values, _fixed_breaks(values), engine=engine)
+
+def unique(values, engine):
+    for uniq,members in cp.unique(values):
+        pass
+
+def unique_counts(values, engine):
+    for uniq,count in cp.unique_counts(values):
+        pass
+
+def membership(values, engine):
+    lo,hi = min(values),max(values)
+    step = (hi - lo) / 10.0
+    ranges = [(lo + i*step, lo + (i+3)*step) for i in range(10)]
+    for valrange,members in cp.membership(values, ranges):
+        pass
+
+def rescale(values, engine):
+    for item,newval in cp.rescale(values, (0,0,0), (255,255,255)):
+        pass
+
+def rescale_buffer(values, engine):
+    cp.rescale_buffer(values, (0,0,0), (255,255,255), uint8=True, engine=engine)
+
+def classifier_iter(values, engine):
+    cfier = cp.Classifier(values, "natural", [(0,255,0),(255,0,0)], classes=5, engine=engine)
+    for item,classval in cfier:
+        pass
+
+# ordered name-function pairs, cases that do not depend on the engine are only run once
+CASES = [(case.__name__, case, True) for case in map(_breaks_case, ALGORITHMS)]
+CASES += [("split_sorted", split_sorted, False),
+          ("split_unsorted", split_unsorted, False),
+          ("assign", assign, True),
+          ("summarize", summarize, True),
+          ("unique", unique, False),
+          ("unique_counts", unique_counts, False),
+          ("membership", membership, False),
+          ("rescale", rescale, False),
+          ("rescale_buffer", rescale_buffer, True),
+          ("classifier_iter", classifier_iter, True)]
@@ -0,0 +1,30 @@
+"""
+Synthetic value distributions to benchmark on.
+All are non-negative so that every algorithm, including log, can be run.
+"""
+
+import random
+
+
+
+def uniform(n, rand):
+    return [rand.uniform(0, 1000) for _ in range(n)]
+
+def heavytailed(n, rand):
+    # pareto distributed, a few very large values
+    return [rand.paretovariate(1.2) for _ in range(n)]
+
+def duplicates(n, rand):
+    # many repeats of few distinct values, like codes or rounded elevations
+    return [float(rand.randint(0, 99)) for _ in range(n)]
+
+DISTRIBUTIONS = {"uniform": uniform,
+                 "heavytailed": heavytailed,
+                 "duplicates": duplicates}
+
+def make_values(distribution, n, seed=0):
+    """
+    Returns a list of n values from the named distribution, the same for the same seed.
+    """
+    rand = random.Random("%s:%s:%s" % (distribution, n, seed))
+    return DISTRIBUTIONS[distribution](n, rand)
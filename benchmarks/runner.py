@@ -0,0 +1,104 @@
+"""
+Measuring, reporting, saving and comparing benchmark results.
+"""
+
+from __future__ import print_function
+import gc
+import json
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    from time import perf_counter as _clock
+except ImportError:
+    _clock = time.time
+
+from .datasets import make_values
+from .cases import CASES
+
+
+
+def measure(case, values, engine, repeat=3):
+    """
+    Returns the best wall time in seconds out of repeat runs, and the peak
+    memory in bytes from a separate traced run (None if tracemalloc is missing).
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = _clock()
+        case(values, engine)
+        times.append(_clock() - start)
+
+    peak = None
+    if tracemalloc:
+        gc.collect()
+        tracemalloc.start()
+        case(values, engine)
+        _,peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return min(times), peak
+
+def run(sizes, distributions, engines, cases=None, repeat=3, output=print):
+    """
+    Runs all combinations of the benchmark cases, sizes, distributions and engines.
+
+    Returns:
+
+    - A dict of result dicts, keyed by "case|distribution|size|engine".
+    """
+    results = {}
+    output("%-22s %-12s %10s %-7s %10s %10s %14s" % ("case", "distribution", "size", "engine", "time (s)", "peak (MB)", "values/s"))
+    for size in sizes:
+        for dist in distributions:
+            values = make_values(dist, size)
+            for name,case,uses_engine in CASES:
+                if cases and name not in cases:
+                    continue
+                for engine in (engines if uses_engine else engines[:1]):
+                    if not uses_engine:
+                        engine = "-"
+                    seconds,peak = measure(case, values, None if engine == "-" else engine, repeat)
+                    key = "|".join((name, dist, str(size), engine))
+                    results[key] = dict(time=seconds, peak=peak, throughput=size/seconds if seconds else None)
+                    output("%-22s %-12s %10d %-7s %10.4f %10s %14s" % (name, dist, size, engine, seconds,
+                                                                       "%.1f" % (peak/1e6) if peak is not None else "-",
+                                                                       "%.0f" % (size/seconds) if seconds else "-"))
+    return results
+
+def save(results, path):
+    """
+    Saves results as a json baseline.
+    """
+    with open(path, "w") as fobj:
+        json.dump(results, fobj, indent=1, sort_keys=True)
+
+def compare(results, path, threshold=1.2, output=print):
+    """
+    Compares results to a saved json baseline, reporting the time ratio of every
+    case present in both and flagging those slower than the threshold ratio.
+
+    Returns:
+
+    - A list of the keys of the cases that were slower than the threshold.
+    """
+    with open(path) as fobj:
+        baseline = json.load(fobj)
+    slower = []
+    output("\n%-50s %10s %10s %8s" % ("case|distribution|size|engine", "baseline", "now", "ratio"))
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        old,new = baseline[key]["time"], results[key]["time"]
+        ratio = new / old if old else float("inf")
+        flag = ""
+        if ratio > threshold:
+            slower.append(key)
+            flag = "  SLOWER"
+        output("%-50s %10.4f %10.4f %8.2f%s" % (key, old, new, ratio, flag))
+    return slower
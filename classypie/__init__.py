@@ -27,6 +27,10 @@ Python 2 and 3.
 
 Pure Python, no dependencies. 
 
+If NumPy is installed, the break point algorithms automatically use a vectorized
+NumPy engine, which is much faster for large datasets. The engine can also be
+chosen explicitly with the `engine` argument ('python' or 'numpy'). 
+
 
 ## Installation
 
@@ -102,5 +106,11 @@ __version__ = "0.1.0"
 
 
 from .main import *
+from .stream import FrequencyTable, QuantileSketch, Stats
+from .cache import BreaksCache
+from .prepared import PreparedValues
+from .profile import Profile
+from .raster import raster_breaks, classify_raster
+from .buffers import open_values
 
 
@@ -7,8 +7,99 @@ directly, but rather use the higher-level functionality in main.py.
 # modified: Karim Bahgat, 2015
 
 from __future__ import division
+import array
+import bisect
 import math
 import random
+import sys
+
+from .stream import FrequencyTable, QuantileSketch, Stats
+from . import profile as _profile
+
+
+
+# Engine selection
+
+ENGINES = ("python", "numpy")
+
+def get_engine(engine=None):
+    """
+    Resolves the name of the engine used to compute breakpoints.
+
+    - None or 'auto': 'numpy' if NumPy is importable, otherwise 'python'.
+    - 'python': the pure-Python implementations in this module.
+    - 'numpy': the vectorized implementations in npbreaks.py, raises Exception
+        if NumPy is not installed.
+    """
+    if engine in (None, "auto"):
+        try:
+            import numpy
+            return "numpy"
+        except ImportError:
+            return "python"
+    elif engine == "numpy":
+        try:
+            import numpy
+        except ImportError:
+            raise Exception("The numpy engine requires NumPy to be installed")
+        return engine
+    elif engine == "python":
+        return engine
+    else:
+        raise Exception("Unknown engine %r, must be one of %s" % (engine, ENGINES))
+
+def get_algorithm(name, engine=None):
+    """
+    Returns the breakpoint function for algorithm 'name' in the given engine
+    (see get_engine).
+    """
+    if get_engine(engine) == "numpy":
+        from . import npbreaks
+        module = npbreaks
+    else:
+        module = sys.modules[__name__]
+    func = getattr(module, name, None)
+    if not callable(func) or name.startswith("_") or name.startswith("get_"):
+        raise Exception("Unknown breaks algorithm %r" % name)
+    return func
+
+# What each algorithm needs from the values, so that only as much work as needed is
+# done before calling it:
+# - stats: only summary statistics such as the min, max and mean, which are found in
+#     single passes over the unsorted values (or from a Stats accumulator).
+# - order: only the order statistics at the positions given by get_ranks, which must be
+#     in their sorted positions while the other values may be in any order.
+# - sorted: all the values in increasing order.
+REQUIREMENTS = {"histogram": "stats",
+                "equal": "stats",
+                "log": "stats",
+                "pretty": "stats",
+                "stdev": "stats",
+                "quantile": "order",
+                "natural": "sorted",
+                "headtail": "sorted",
+                }
+
+def get_requirement(name):
+    """
+    Returns what algorithm 'name' needs from the values, either 'stats', 'order' or 'sorted'
+    (see REQUIREMENTS). Unknown algorithms are assumed to need the sorted values.
+    """
+    return REQUIREMENTS.get(name, "sorted")
+
+def get_ranks(name, n, classes=5, **kwargs):
+    """
+    Returns the sorted list of positions of the order statistics that algorithm 'name'
+    reads from 'n' sorted values, or None if it needs all of them.
+    """
+    if get_requirement(name) != "order" or n <= classes:
+        return None
+    # the values that quantile interpolates between, along with the maximum
+    ranks = set([n-1])
+    for i in range(classes):
+        aa = int(i / float(classes) * n)
+        ranks.update((aa, aa+1))
+    return sorted(ranks)
 
 
 
@@ -26,10 +117,23 @@ def equal(values, classes=5, interval=None, anchor=None, clip=True, start=None,
     
     Returns breaks based on dividing the range of 'values' into 'classes' parts,
     or by specifying the interval and/or anchorpoint to start the divisioning. 
+
+    Values can also be a Stats accumulator or FrequencyTable.
     """
     #values = sorted(values) # maybe not needed as is already done main.py
 
-    if len(values) == 1:
+    if isinstance(values, FrequencyTable):
+        values = values.stats
+
+    if isinstance(values, Stats):
+        # only the value range is needed
+        if values.count == 1:
+            return [values.min] * 2
+        if start is None: start = values.min
+        if end is None: end = values.max
+        values = None
+
+    if values and len(values) == 1:
         # when too few values, just return breakpoints for each unique value, ignoring classes
         return values * 2
     
@@ -82,16 +186,28 @@ def log(values, classes=5):
 
     Returns break points at equal intervals of the log10 of input values.
     Handles 0s by adding 1 before log transforming. Negative values will raise Exception.
+
+    Values can also be a Stats accumulator or FrequencyTable.
     """
-    # if too few values, just return breakpoints for each unique value, ignoring classes
-    if len(values) == 1:
-        return values * 2
-    
-    # log transform values
-    logs = [math.log10(v+1) for v in values]
+    if isinstance(values, FrequencyTable):
+        values = values.stats
+
+    if isinstance(values, Stats):
+        if values.count == 1:
+            return [values.min] * 2
+        # log is monotonic, so the log range is the log of the value range
+        minval,maxval = math.log10(values.min+1), math.log10(values.max+1)
+
+    else:
+        # if too few values, just return breakpoints for each unique value, ignoring classes
+        if len(values) == 1:
+            return values * 2
+
+        # log transform values
+        logs = [math.log10(v+1) for v in values]
+        minval,maxval = min(logs),max(logs)
 
     # create breaks
-    minval,maxval = min(logs),max(logs)
     interval = (maxval-minval)/float(classes)
     logbreaks = []
     cur = minval
@@ -109,25 +225,47 @@ def quantile(values, classes=5):
     Quantile algorithm in Python
     
     Returns values taken at regular intervals from the cumulative 
-    distribution function (CDF) of 'values'.
+    distribution function (CDF) of 'values'. Expects sorted values, or at least 
+    the values at the positions given by get_ranks in their sorted positions.
+
+    Values can also be a QuantileSketch built from a stream of values, 
+    in which case the breaks are approximate, or a FrequencyTable, in which
+    case the order statistics are found by binary search of the cumulative counts.
     """
 
     #values = sorted(values) # maybe not needed as is already done main.py
 
-    # if too few values, just return breakpoints for each unique value, ignoring classes
-    if len(values) <= classes:
-        return list(values) + [values[-1]]
-    
-    n = len(values)
+    if isinstance(values, QuantileSketch):
+        if len(values) > classes:
+            return values.quantiles([i / float(classes) for i in range(classes+1)])
+        # small sketches still hold all the values
+        values = [value for value,_ in values.weighted_values()]
+
+    if isinstance(values, FrequencyTable) and (values.count > classes or not values.integral):
+        n = values.count
+        at = values.value_at
+        top = values.max
+    else:
+        if isinstance(values, FrequencyTable):
+            values = values.expand()
+
+        # if too few values, just return breakpoints for each unique value, ignoring classes
+        if len(values) <= classes:
+            return list(values) + [values[-1]]
+
+        n = len(values)
+        at = values.__getitem__
+        top = values[n-1]
+
     breaks = []
     for i in range(classes):
         q = i / float(classes)
         a = q * n
         aa = int(q * n)
         r = a - aa
-        Xq = (1 - r) * values[aa] + r * values[aa+1]
+        Xq = (1 - r) * at(aa) + r * at(aa+1)
         breaks.append(Xq)
-    breaks.append(values[n-1])
+    breaks.append(top)
     return breaks
 
 def pretty(values, classes=5, start=None, end=None):
@@ -145,8 +283,20 @@ def pretty(values, classes=5, start=None, end=None):
     Parameters:
         values : list of input values
         classes     : number of class intervals
+
+    Values can also be a Stats accumulator or FrequencyTable.
     """
 
+    if isinstance(values, FrequencyTable):
+        values = values.stats
+
+    if isinstance(values, Stats):
+        if values.count == 1:
+            return [values.min] * 2
+        if start is None: start = values.min
+        if end is None: end = values.max
+        values = None
+
     # if too few values, just return breakpoints for each unique value, ignoring classes
     if values and len(values) == 1:
         return values * 2
@@ -249,26 +399,42 @@ def stdev(values, classes=5):
     
     Returns breaks based on 'pretty' of the centred and scaled values of 'values',
     and may have a number of classes different from 'classes'.
+
+    Values can also be a Stats accumulator. Since the individual values are not
+    available from an accumulator, too few values just returns the min and max. 
+    Values can also be a FrequencyTable.
     """
 
-    # if too few values, just return breakpoints for each unique value, ignoring classes
-    if len(values) <= classes:
-        return list(values) + [values[-1]]
-
-    sd2 = 0.0
-    N = len(values)
-    _min = min(values)
-    _max = max(values)
-    mean = sum(values) / N
-    for i in values:
-        sd = i - mean
-        sd2 += sd * sd
-    sd2 = math.sqrt(sd2 / N)
+    if isinstance(values, FrequencyTable):
+        values = values.expand() if values.count <= classes and values.integral else values.stats
+
+    if isinstance(values, Stats):
+        if values.count <= classes or not values.stdev:
+            return [values.min, values.max]
+        _min, _max = values.min, values.max
+        mean, sd2 = values.mean, values.stdev
+
+    else:
+        # if too few values, just return breakpoints for each unique value, ignoring classes
+        if len(values) <= classes:
+            values = sorted(values)
+            return values + [values[-1]]
+
+        sd2 = 0.0
+        N = len(values)
+        _min = min(values)
+        _max = max(values)
+        mean = sum(values) / N
+        for i in values:
+            sd = i - mean
+            sd2 += sd * sd
+        sd2 = math.sqrt(sd2 / N)
+
     res = pretty(values=None, classes=5, start=(_min-mean)/sd2, end=(_max-mean)/sd2)
     res2 = [(val*sd2)+mean for val in res]
     return res2
 
-def natural(values, classes=5, maxsize=1000, samples=3):
+def natural(values, classes=5, maxsize=None, samples=3, workers=None, seed=None):
     """
     Jenks Optimal (Natural Breaks) algorithm implemented in Python.
     The original Python code comes from here:
@@ -279,126 +445,232 @@ def natural(values, classes=5, maxsize=1000, samples=3):
     Returns class breaks such that classes are internally homogeneous while 
     assuring heterogeneity among classes.
 
-    For very large datasets (larger than maxsize), will calculate only on
-    subsample to avoid exponential runtimes. Calculated multiple times (samples)
-    and takes the average break values for better consistency. Lower and higher
-    bounds are kept intact. 
+    The optimal partition is found exactly with a divide-and-conquer dynamic
+    program over prefix sums, which takes O(classes * n * log(n)) time and
+    only keeps compact array rows in memory, so sampling is not needed.
+    Duplicate values are collapsed into weighted runs first, so n is the
+    number of distinct values rather than the number of values. 
+
+    Optionally, for datasets larger than maxsize, will calculate only on
+    subsample. Calculated multiple times (samples) and takes the average
+    break values for better consistency. Lower and higher bounds are kept intact. 
+    The samples are drawn with deterministic per-sample seeds derived from seed
+    (if given), and can be processed in parallel by a pool of workers processes. 
+
+    Values can also be a FrequencyTable, whose distinct values and counts are
+    used directly as the weighted runs, and whose samples are drawn by rank. 
     """
 
     #values = sorted(values) # maybe not needed as is already done main.py
 
-    # if too few values, just return breakpoints for each unique value, ignoring classes
-    if len(values) <= classes:
-        return list(values) + [values[-1]]
-
-    def getbreaks(values, classes):
-        # the original algorithm by Carson Farmer
-        mat1 = []
-        for i in range(0,len(values)+1):
-            temp = []
-            for j in range(0,classes+1):
-                temp.append(0)
-            mat1.append(temp)
-        mat2 = []
-        for i in range(0,len(values)+1):
-            temp = []
-            for j in range(0,classes+1):
-                temp.append(0)
-            mat2.append(temp)
-        for i in range(1,classes+1):
-            mat1[1][i] = 1
-            mat2[1][i] = 0
-            for j in range(2,len(values)+1):
-                mat2[j][i] = float('inf')
-        v = 0.0
-        for l in range(2,len(values)+1):
-            s1 = 0.0
-            s2 = 0.0
-            w = 0.0
-            for m in range(1,l+1):
-                i3 = l - m + 1
-                val = float(values[i3-1])
-                s2 += val * val
-                s1 += val
-                w += 1
-                v = s2 - (s1 * s1) / w
-                i4 = i3 - 1
-                if i4 != 0:
-                    for j in range(2,classes+1):
-                        if mat2[l][j] >= (v + mat2[i4][j - 1]):
-                            mat1[l][j] = i3
-                            mat2[l][j] = v + mat2[i4][j - 1]
-            mat1[l][1] = 1
-            mat2[l][1] = v
-        k = len(values)
-        kclass = []
-        for i in range(0,classes+1):
-            kclass.append(0)
-        kclass[classes] = float(values[len(values) - 1])
-        kclass[0] = float(values[0])
-        countNum = classes
-        while countNum >= 2:
-            id = int((mat1[k][countNum]) - 2)
-            kclass[countNum - 1] = values[id]
-            k = int((mat1[k][countNum] - 1))
-            countNum -= 1
-        return kclass
-
-    # Automatic sub sampling for large datasets
+    if isinstance(values, FrequencyTable) and (values.count > classes or not values.integral):
+        if not (maxsize and values.count > maxsize):
+            # the distinct values and their counts are already the weighted runs
+            if len(values) <= classes:
+                return list(values.values) + [values.max]
+            return _jenks(values.values, values.counts, classes)
+        n = int(values.count)
+        at = values.value_at
+        top = values.max
+    else:
+        if isinstance(values, FrequencyTable):
+            values = values.expand()
+
+        # if too few values, just return breakpoints for each unique value, ignoring classes
+        if len(values) <= classes:
+            return list(values) + [values[-1]]
+
+        n = len(values)
+        at = values.__getitem__
+        top = values[n-1]
+
+    # Optional sub sampling for large datasets
     # The idea of using random sampling for large datasets was in the original code. 
     # However, since these samples tend to produce different results,
     # ...to produce more stable results we might as well calculate the
     # ...breaks several times and using the sample means for the final break values.
     
-    if len(values) > maxsize:
-        allrandomsamples = []
-        for _ in range(samples):
-            randomsample = sorted(random.sample(values, maxsize))
+    if maxsize and n > maxsize:
+        randomsamples = []
+        for seed in _sample_seeds(samples, seed):
+            # sampling the positions picks the same values as sampling the values themselves
+            randomsample = sorted(at(i) for i in random.Random(seed).sample(range(n), maxsize))
             
             # include lower and higher bounds to ensure the whole range is considered
-            randomsample[0] = values[0] 
-            randomsample[-1] = values[-1]
-            
-            # get sample break
-            tempbreaks = getbreaks(randomsample, classes)
-            allrandomsamples.append(tempbreaks)
+            randomsample[0] = at(0)
+            randomsample[-1] = top
+            randomsamples.append((randomsample, classes))
+
+        # get sample breaks
+        allrandomsamples = _map(_jenks_runs, randomsamples, workers)
             
         # get average of all sampled break values
         jenksbreaks = [sum(allbreakvalues)/float(len(allbreakvalues))
                        for allbreakvalues in zip(*allrandomsamples)]
         
     else:
-        jenksbreaks = getbreaks(values, classes)
+        jenksbreaks = _jenks_runs(values, classes)
 
     return jenksbreaks
 
+def _sample_seeds(samples, seed=None):
+    # one seed per sample, reproducible if seed is given, otherwise from the global random state
+    if seed is None:
+        return [random.getrandbits(32) for _ in range(samples)]
+    return ["%s:%s" % (seed, i) for i in range(samples)]
+
+def _map(func, argslist, workers=None):
+    # calls a module-level func for each tuple of args, in a process pool if workers > 1
+    # falls back to calling in sequence if concurrent.futures is not available
+    if workers and workers > 1 and len(argslist) > 1:
+        try:
+            from concurrent.futures import ProcessPoolExecutor
+        except ImportError:
+            ProcessPoolExecutor = None
+        if ProcessPoolExecutor:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            try:
+                return list(executor.map(func, *zip(*argslist)))
+            finally:
+                executor.shutdown()
+    return [func(*args) for args in argslist]
+
+def _runs(values):
+    # collapse sorted values into unique values and their counts
+    uniq = array.array('d')
+    counts = array.array('d')
+    prev = None
+    for val in values:
+        if val == prev:
+            counts[-1] += 1
+        else:
+            uniq.append(val)
+            counts.append(1)
+            prev = val
+    return uniq, counts
+
+def _jenks_runs(values, classes):
+    # duplicate values always end up in the same class, so the dynamic program
+    # only needs to run over the weighted unique values
+    uniq, counts = _runs(values)
+    if len(uniq) <= classes:
+        return list(uniq) + [uniq[-1]]
+    return _jenks(uniq, counts, classes)
+
+def _jenks(values, weights, classes):
+    # Exact optimal 1-D partition of sorted weighted values into classes, minimizing
+    # the weighted sum of squared deviations from the class means.
+    # D[j][i] is the lowest cost of splitting the first i values into j classes,
+    # D[j][i] = min over t of D[j-1][t] + cost(t, i), where cost(t, i) is the
+    # squared deviation of values[t:i]. The optimal t never decreases with i,
+    # so each row can be filled by divide-and-conquer in O(n log n).
+    n = len(values)
+    inf = float('inf')
+
+    # prefix sums, shifted by a middle value to limit cancellation errors
+    shift = float(values[n // 2])
+    s0 = array.array('d', [0.0]) * (n+1)
+    s1 = array.array('d', [0.0]) * (n+1)
+    s2 = array.array('d', [0.0]) * (n+1)
+    t0 = t1 = t2 = 0.0
+    for i in range(n):
+        val = float(values[i]) - shift
+        w = weights[i]
+        t0 += w
+        t1 += w * val
+        t2 += w * val * val
+        s0[i+1] = t0
+        s1[i+1] = t1
+        s2[i+1] = t2
+
+    # first row, a single class
+    prev = array.array('d', [0.0]) * (n+1)
+    for i in range(1, n+1):
+        prev[i] = s2[i] - s1[i] * s1[i] / s0[i]
+
+    # fill remaining rows, remembering where the last class starts
+    starts = []
+    cells = 0
+    for j in range(2, classes+1):
+        cur = array.array('d', [inf]) * (n+1)
+        back = array.array('l', [0]) * (n+1)
+        if j == classes:
+            # last row only needs the full dataset
+            stack = [(n, n, j-1, n-1)]
+        else:
+            stack = [(j, n, j-1, n-1)]
+        while stack:
+            lo, hi, optlo, opthi = stack.pop()
+            mid = (lo + hi) // 2
+            best = inf
+            bestt = optlo
+            sm0 = s0[mid]
+            sm1 = s1[mid]
+            sm2 = s2[mid]
+            cells += max(min(mid-1, opthi) - optlo + 1, 0)
+            for t in range(optlo, min(mid-1, opthi)+1):
+                a = sm1 - s1[t]
+                cost = prev[t] + (sm2 - s2[t]) - a * a / (sm0 - s0[t])
+                if cost < best:
+                    best = cost
+                    bestt = t
+            cur[mid] = best
+            back[mid] = bestt
+            if lo < mid:
+                stack.append((lo, mid-1, optlo, bestt))
+            if mid < hi:
+                stack.append((mid+1, hi, bestt, opthi))
+        starts.append(back)
+        prev = cur
+    _profile.count("natural_cells", cells)
+
+    # backtrack the class starts, break values are the last value of each class
+    kclass = [0.0] * (classes+1)
+    kclass[0] = float(values[0])
+    kclass[classes] = float(values[n-1])
+    i = n
+    for j in range(classes, 1, -1):
+        i = starts[j-2][i]
+        kclass[j-1] = float(values[i-1])
+    return kclass
+
 def headtail(values, classes=5):
     """
     New head tails classification scheme,
     claimed to better highlight a few very
     large values than natural breaks.
     See: http://arxiv.org/ftp/arxiv/papers/1209/1209.2801.pdf
+
+    Expects sorted values. Since the values are sorted, each head is the
+    tail end of the values, so it is found by bisecting at the mean rather
+    than copying the values. The heads shrink by at least half each time,
+    so the total work is O(n). If more classes than the classes argument
+    are found, the top classes are merged. 
+
+    Values can also be a FrequencyTable, in which case the heads are found
+    among the distinct values, weighted by their counts. 
     """
 
+    if isinstance(values, FrequencyTable):
+        return _headtail_weighted(values.values, values.counts, values.count, classes)
+
     # if too few values, just return breakpoints for each unique value, ignoring classes
     if len(values) == 1:
         return values * 2
 
-    def _mean(values):
-        return sum(values)/float(len(values))
-    
-    def _mbreak(values):
-        m = _mean(values)
-        head = [v for v in values if v >= m]
-        tail = [v for v in values if v < m]
-        return head,m,tail
-
+    # the head is values[start:], and everything below the mean of the head is the next tail
+    n = len(values)
+    start = 0
     breaks = []
-    head,m,tail = _mbreak(values)
-    while len(tail) > len(head):
+    m = sum(values) / float(n)
+    nexthead = bisect.bisect_left(values, m)
+    while nexthead - start > n - nexthead:
+        _profile.count("headtail_iterations")
         breaks.append(m)
-        if len(head) > 1:
-            head,m,tail = _mbreak(head)
+        if n - nexthead > 1:
+            start = nexthead
+            m = sum(values[i] for i in range(start, n)) / float(n - start)
+            nexthead = bisect.bisect_left(values, m, start)
         else:
             break
 
@@ -407,11 +679,43 @@ def headtail(values, classes=5):
     breaks.append(values[-1])
     
     # merge top breaks until under maxclasses
-    if classes and len(breaks) > classes:
-        pass
+    if classes and len(breaks) - 1 > classes:
+        del breaks[classes:-1]
         
     return breaks
 
+def _headtail_weighted(values, counts, total, classes):
+    # same as headtail for sorted distinct values with counts, where the head and
+    # tail sizes are the sums of their counts
+    if total == 1:
+        return [values[0]] * 2
+
+    start = 0
+    breaks = []
+    headcount = total
+    m = sum(val * cnt for val,cnt in zip(values, counts)) / float(headcount)
+    nexthead = bisect.bisect_left(values, m)
+    tailcount = sum(counts[i] for i in range(nexthead))
+    while tailcount > headcount - tailcount:
+        _profile.count("headtail_iterations")
+        breaks.append(m)
+        headcount -= tailcount
+        if headcount > 1:
+            start = nexthead
+            m = sum(values[i] * counts[i] for i in range(start, len(values))) / float(headcount)
+            nexthead = bisect.bisect_left(values, m, start)
+            tailcount = sum(counts[i] for i in range(start, nexthead))
+        else:
+            break
+
+    breaks.insert(0, values[0])
+    breaks.append(values[-1])
+
+    if classes and len(breaks) - 1 > classes:
+        del breaks[classes:-1]
+
+    return breaks
+
 ##def auto(values, classes=5, **kwargs):
 ##    raise NotImplementedError()
 
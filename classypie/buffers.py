@@ -0,0 +1,126 @@
+"""
+Support for classifying values that are already stored in compact binary form, such as
+`array.array`, `memoryview`, `mmap` and numpy arrays, reading them directly rather than
+item by item. The numpy engine reads them in place, while the python engine converts them
+to Python floats in a single call, or one at a time for algorithms that need only one pass.
+"""
+
+import array
+import mmap
+import os
+
+# buffer formats of plain numbers
+_NUMBER_FORMATS = set("bBhHiIlLqQfd")
+
+
+
+def open_values(path, typecode='d', offset=0, count=None):
+    """
+    Opens a raw binary file of numbers as a read-only, memory-mapped value column,
+    which can be passed directly as the items to `breaks`, `split` and the other functions.
+    The file is paged in by the operating system as needed rather than read into memory.
+
+    Example:
+
+        >>> values = classypie.open_values("elevation.f64")
+        >>> breaks = classypie.breaks(values, "quantile", classes=5)
+
+    Args:
+
+    - **path**: Path of the binary file, containing the numbers one after another in native byte order.
+    - **typecode** (optional): The `array` module typecode of the numbers. Defaults to 'd' for float64.
+    - **offset** (optional): Number of bytes to skip at the start of the file, eg a header.
+    - **count** (optional): Number of values to read. Defaults to all the remaining values in the file.
+
+    Returns:
+
+    - A `memoryview` of the values. On Python 2, which cannot view a memory map as numbers,
+        the values are instead read into an `array.array`.
+    """
+    itemsize = array.array(typecode).itemsize
+    if count is None:
+        count = (os.path.getsize(path) - offset) // itemsize
+    end = offset + count * itemsize
+
+    if not hasattr(memoryview, "cast"):
+        values = array.array(typecode)
+        with open(path, "rb") as fobj:
+            fobj.seek(offset)
+            values.fromfile(fobj, count)
+        return values
+
+    with open(path, "rb") as fobj:
+        # the map keeps its own handle to the file
+        mapped = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped)[offset:end].cast(typecode)
+
+def _view(obj):
+    # a flat memoryview of the numbers in an array.array, memoryview or mmap (which
+    # is read as raw float64), or None if obj is not such a buffer of numbers
+    if not hasattr(memoryview, "cast"):
+        # python 2, only arrays are supported
+        if isinstance(obj, array.array) and obj.typecode in _NUMBER_FORMATS:
+            return obj
+        return None
+    if isinstance(obj, mmap.mmap):
+        return memoryview(obj).cast('d')
+    if isinstance(obj, array.array):
+        view = memoryview(obj)
+    elif isinstance(obj, memoryview):
+        view = obj
+    else:
+        return None
+    if view.ndim != 1 or view.format.lstrip("@") not in _NUMBER_FORMATS:
+        return None
+    return view
+
+def _column(items, engine, exclude=None, minval=None, maxval=None, stream=False):
+    # the numbers of a buffer or 1-D numpy array, optionally filtered, read directly rather than
+    # item by item. For the numpy engine a float64 numpy array, which is read in place from the items
+    # where possible and so must be copied before being modified. Otherwise a list, or if stream is
+    # True, an iterable that reads the values one at a time instead of copying them.
+    # Returns None if the items are not such a buffer.
+    if getattr(items, "ndim", None) == 1 and hasattr(items, "dtype") and items.dtype.kind in "biuf":
+        import numpy
+        values = numpy.asarray(items, dtype=numpy.float64)
+        if engine != "numpy":
+            values = values.tolist()
+    else:
+        view = _view(items)
+        if view is None:
+            return None
+        typecode = getattr(view, "format", getattr(view, "typecode", None)).lstrip("@")
+        if engine == "numpy":
+            import numpy
+            values = numpy.asarray(view, dtype=numpy.float64)
+        elif stream:
+            values = view if typecode == 'd' else (float(val) for val in view)
+        elif typecode == 'd':
+            values = view.tolist()
+        else:
+            values = array.array('d', view).tolist()
+
+    if exclude is None and minval is None and maxval is None:
+        return values
+    if exclude is not None:
+        if not isinstance(exclude, (list,tuple)): exclude = [exclude]
+    if engine == "numpy":
+        return values[_mask(values, exclude, minval, maxval)]
+    values = (val for val in values
+              if not ((exclude is not None and val in exclude)
+                      or (minval is not None and val < minval)
+                      or (maxval is not None and val > maxval)))
+    return values if stream else list(values)
+
+def _mask(values, exclude=None, minval=None, maxval=None):
+    # boolean numpy array of whether each value of a numpy array passes the filters
+    import numpy
+    mask = numpy.ones(len(values), dtype=bool)
+    if exclude is not None:
+        if not isinstance(exclude, (list,tuple)): exclude = [exclude]
+        mask &= ~numpy.isin(values, exclude)
+    if minval is not None:
+        mask &= values >= minval
+    if maxval is not None:
+        mask &= values <= maxval
+    return mask
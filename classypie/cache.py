@@ -0,0 +1,104 @@
+"""
+Caching of calculated breaks, so that repeatedly classifying the same
+values with the same settings does not have to sort the values and rerun
+the algorithm every time.
+"""
+
+import array
+import hashlib
+from collections import OrderedDict
+
+
+
+class BreaksCache(object):
+    """
+    A least-recently-used cache of calculated breaks, keyed by a fingerprint of the values
+    along with the algorithm name and all its options. Pass it as the `cache` argument to
+    `classypie.breaks` or `Classifier`, or pass `cache=True` to use the shared `default_cache`.
+
+    Attributes:
+
+    - maxsize: The maximum number of breaks to keep, after which the least recently used are evicted.
+    - hits: Number of lookups that were found in the cache.
+    - misses: Number of lookups that were not found in the cache.
+
+    Example:
+
+        >>> cache = classypie.BreaksCache(maxsize=100)
+        >>> classypie.breaks(values, "natural", classes=7, cache=cache)
+        >>> classypie.breaks(values, "natural", classes=7, cache=cache) # cache hit
+        >>> cache.hits, cache.misses
+        (1, 1)
+    """
+
+    def __init__(self, maxsize=128):
+        """
+        Args:
+
+        - **maxsize** (optional): The maximum number of breaks to keep. Defaults to 128.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __repr__(self):
+        return "BreaksCache(maxsize=%s, size=%s, hits=%s, misses=%s)" % (self.maxsize, len(self), self.hits, self.misses)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns a copy of the breaks stored for a key, or None if not found.
+        """
+        breaks = self._entries.pop(key, None)
+        if breaks is None:
+            self.misses += 1
+            return None
+        # move to the most recently used end
+        self._entries[key] = breaks
+        self.hits += 1
+        return list(breaks)
+
+    def put(self, key, breaks):
+        """
+        Stores a copy of the breaks for a key, evicting the least recently used
+        breaks if the cache is full.
+        """
+        self._entries.pop(key, None)
+        self._entries[key] = tuple(breaks)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Removes all stored breaks and resets the hit and miss counters.
+        """
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+default_cache = BreaksCache()
+
+
+def fingerprint(values):
+    """
+    Returns a fingerprint string identifying a sequence of float values, in their current order.
+    Values can be a list or a numpy array.
+    """
+    if hasattr(values, "tobytes") and getattr(values, "dtype", None) is not None:
+        # numpy array
+        data = values.tobytes()
+    else:
+        data = array.array('d', values)
+        data = data.tobytes() if hasattr(data, "tobytes") else data.tostring()
+    return "%s:%s" % (len(values), hashlib.sha1(data).hexdigest())
+
+def make_key(values_fingerprint, algorithm, **options):
+    """
+    Returns a hashable cache key for a values fingerprint, algorithm name, and any other options
+    that affect the result.
+    """
+    return (values_fingerprint, algorithm, repr(sorted(options.items())))
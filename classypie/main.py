@@ -4,15 +4,48 @@ Contains the main functionality for end-users.
 
 from __future__ import division
 from . import breaks as _breaks
+from .stream import FrequencyTable, QuantileSketch, Stats
+from . import cache as _cache
+from .prepared import PreparedValues
+from . import profile as _profile
+from .buffers import _column, _mask
 import itertools
+import contextlib
+from collections import OrderedDict, Counter
 import math
+import bisect
+import array
 
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
 
 
+
+def _dirty_property(name, breaks=False):
+    # a Classifier attribute that, when set, marks the class values and optionally
+    # the breaks to be recalculated the next time they are needed
+    attr = "_" + name
+    def getter(self):
+        return getattr(self, attr)
+    def setter(self, value):
+        setattr(self, attr, value)
+        self._classvalues_dirty = True
+        if breaks or (name == "classvalues" and self._algo == "proportional"):
+            self._breaks_dirty = True
+            self._index = None
+    return property(getter, setter)
+
+# placeholder for the items removed from a Classifier until its items list is next read
+_REMOVED = object()
+
 class Classifier(object):
     """
     A convenience class for managing a set of items/values according to a classification.
-    Upon initiation the classifier uses the input values to calculate the breakpoints and class values.
+    The breakpoints and class values are calculated from the input values the first time they are needed,
+    and recalculated only when the attributes they depend on are changed. Changing the classvalues only
+    reinterpolates the class values, while changing the items, algo, key, engine or kwargs also recalculates the breaks.
     The classifier can then be iterated through to yield a tuple of the original items along
     with the symbolic class value representing the group they belong to.
 
@@ -21,19 +54,23 @@ class Classifier(object):
     - items: The list of items or values managed by the classifier.
     - algo: The name of the algorithm used to calculate the breakpoints, or 'custom' if the
         breakpoints were manually specified. 
-    - breaks: Calculated list of break points. 
+    - breaks: Calculated list of break points. Setting it to a list of custom break points changes the algo to 'custom'. 
     - classvalues: The original bounds/gradient of symbolic values to assign to each of the classes. 
     - classvalues_interp: The interpolated gradient of symbolic values, one for each class grouping. 
     - key: Function used to extract value from each item, defaults to None and treats item itself as the value.
+    - engine: The engine used to calculate the breakpoints, 'python', 'numpy', or None to pick automatically.
     - kwargs: The kwargs to pass to the algorithm function.
             The algorithm functions and their arguments can be found in `classypie.breaks`.
+            Changes are only detected when a new dictionary is assigned, otherwise call update(). 
+    - stats: If profiling, a dictionary of the total time spent in each stage and the counters, summed
+        over all operations of the classifier so far, see `Profile`. Otherwise None. 
     """
     
-    def __init__(self, items, breaks, classvalues, key=None, **kwargs):
+    def __init__(self, items, breaks, classvalues, key=None, engine=None, profile=False, **kwargs):
         """
         Args:
 
-        - **items**: The list of items or values to classify.
+        - **items**: The list of items or values to classify, or a `PreparedValues` of them.
         - **breaks**: List of custom break values, or the name of the algorithm to use.
             Valid names are:
             - histogram (alias for equal)
@@ -53,6 +90,12 @@ class Classifier(object):
             and so all sequences must be equally long. Thus, specifying the
             classvalues as rgb color tuples will create interpolated color gradients.
         - **key** (optional): Function used to extract value from each item, defaults to None and treats item itself as the value.
+        - **engine** (optional): The engine used to calculate the breaks, either 'python' or 'numpy'.
+            Defaults to None, which uses numpy if it is installed and pure Python otherwise.
+        - **profile** (optional): If True, records the time spent in each stage of the classifier operations
+            in the `stats` attribute. Can also be a function, which is then called with the stats of each
+            operation (update, iterate, edit, assign or summarize) as it finishes, eg for reporting to a metrics system.
+            Iterating a profiled classifier collects all the items and class values before yielding the first. 
         - **extrabreaks** (optional): Force insert additional break points. These are added to the original breakpoints,
             so if the classification resulted in 5 groupings, and you insert 2 additional break values, the final classification
             will contain 7 groupings. 
@@ -64,9 +107,10 @@ class Classifier(object):
             The algorithm functions and their arguments can be found in `classypie.breaks`.
         """
         
-        self.items = items
+        if isinstance(items, PreparedValues) and key is None:
+            key = items.key
         
-        if isinstance(breaks, bytes):
+        if isinstance(breaks, _string_types):
             algo = breaks
             breaks = None
             
@@ -74,14 +118,72 @@ class Classifier(object):
             algo = "custom"
             breaks = breaks
             
-        self.algo = algo
-        self.breaks = breaks
-        self.classvalues = classvalues # the raw preinterpolated valuestops of the classvalues
-        self.key = key
-        self.kwargs = kwargs
-        self.classvalues_interp = None # the final interpolated classvalues
-
-        self.update()
+        self._items = items
+        self._algo = algo
+        self._breaks = breaks
+        self._classvalues = classvalues # the raw preinterpolated valuestops of the classvalues
+        self._key = key
+        self._engine = engine
+        self._kwargs = kwargs
+        self._classvalues_interp = None # the final interpolated classvalues
+        self._index = None # sorted values and stats maintained by add() and remove()
+        self._positions = None # the positions in items of each item, by id, maintained by add() and remove()
+        self._removed = 0 # the number of placeholders left in items by remove()
+        self._owned = False # whether the items list is a copy that can be edited in place
+        self._shared = False # whether the items are shared with the other classifications of a MultiClassifier
+        self._profile = _profile.Profile() if profile else None
+        self._callback = profile if callable(profile) else None
+
+        # nothing is calculated until needed
+        self._breaks_dirty = True
+        self._classvalues_dirty = True
+
+    @property
+    def items(self):
+        if self._removed:
+            self._compact()
+        return self._items
+
+    @items.setter
+    def items(self, items):
+        self._items = items
+        self._positions = None
+        self._removed = 0
+        self._owned = False
+        self._breaks_dirty = True
+        self._classvalues_dirty = True
+        self._index = None
+
+    algo = _dirty_property("algo", breaks=True)
+    key = _dirty_property("key", breaks=True)
+    engine = _dirty_property("engine", breaks=True)
+    kwargs = _dirty_property("kwargs", breaks=True)
+    classvalues = _dirty_property("classvalues")
+
+    @property
+    def breaks(self):
+        if self._breaks_dirty:
+            self._calc_breaks()
+        return self._breaks
+
+    @breaks.setter
+    def breaks(self, breaks):
+        self._algo = "custom"
+        self._breaks = breaks
+        self._breaks_dirty = False
+        self._classvalues_dirty = True
+        self._index = None
+
+    @property
+    def classvalues_interp(self):
+        if self._classvalues_dirty:
+            self._calc_classvalues()
+        return self._classvalues_interp
+
+    @classvalues_interp.setter
+    def classvalues_interp(self, classvalues_interp):
+        self._classvalues_interp = classvalues_interp
+        self._classvalues_dirty = False
 
     def __repr__(self):
         import pprint
@@ -90,48 +192,301 @@ class Classifier(object):
                         classvalues_interp=self.classvalues_interp)
         return "Classifier object:\n" + pprint.pformat(metadict, indent=4)
 
+    @property
+    def stats(self):
+        if self._profile is not None:
+            return self._profile.stats
+
+    @contextlib.contextmanager
+    def _profiling(self, operation):
+        # records the operation and all its stages, if profiling
+        if self._profile is None:
+            yield
+            return
+        if self._profile.recording:
+            # nested operation, eg breaks calculated lazily while iterating, which is
+            # already recorded and reported as part of the outer operation
+            with _profile.stage(operation):
+                yield
+            return
+        with self._profile:
+            with _profile.Profile(callback=self._callback):
+                with _profile.stage(operation):
+                    yield
+
     def update(self):
         """
         Force update/calculate breaks and class values based on the item values.
-        Automatically called when initiating the classifier, but can be useful for
-        recalculating if the classifier attributes have been modified. 
+        The breaks and class values are otherwise calculated when first needed, and
+        recalculated when the classifier attributes are set, so this is only needed
+        if the items or kwargs have been modified in place. 
         Mostly used internally. 
         """
         # force update/calculate breaks and class values
         # mostly used internally, though can be used to recalculate
+        self._calc_breaks()
+        self._calc_classvalues()
+
+    def _calc_breaks(self):
+        with self._profiling("update"):
+            self._index = None
+        
+            if self.algo == "proportional":
+                items,values = zip(*rescale(self._live_items(),
+                                           newmin=self.classvalues[0],
+                                           newmax=self.classvalues[-1],
+                                           key=self.key,
+                                           **self.kwargs))
+                itemvals = list(_valid_values(items, self.key))
+                if self.classvalues[0] < self.classvalues[-1]:
+                    minval,maxval = min(itemvals), max(itemvals)
+                else:
+                    minval,maxval = max(itemvals), min(itemvals)
+                self._breaks = [minval,maxval]
+
+            elif self.algo not in ("custom","unique"):
+                self._breaks = breaks(items=self._live_items(),
+                                      algorithm=self.algo,
+                                      key=self.key,
+                                      engine=self.engine,
+                                      **self.kwargs)
+
+            self._breaks_dirty = False
+            self._classvalues_dirty = True
+
+    def _calc_classvalues(self):
         if self.algo == "unique":
-            self.classvalues_interp = self.classvalues
+            self._classvalues_interp = self.classvalues
 
         elif self.algo == "proportional":
-            self.classvalues_interp = [self.classvalues[0], self.classvalues[-1]]
-            items,values = zip(*rescale(self.items,
-                                       newmin=self.classvalues_interp[0],
-                                       newmax=self.classvalues_interp[-1],
-                                       key=self.key,
-                                       **self.kwargs))
-            itemvals = [self.key(item) for item in items]
-            if self.classvalues_interp[0] < self.classvalues_interp[-1]:
-                minval,maxval = min(itemvals), max(itemvals)
-            else:
-                minval,maxval = max(itemvals), min(itemvals)
-            self.breaks = [minval,maxval]
+            self._classvalues_interp = [self.classvalues[0], self.classvalues[-1]]
 
         else:
-            if self.algo != "custom":
-                self.breaks = breaks(items=self.items,
-                                    algorithm=self.algo,
-                                    key=self.key,
-                                    **self.kwargs)
-            self.classvalues_interp = class_values(len(self.breaks)-1, # -1 because break values include edgevalues so will be one more in length
-                                                   self.classvalues)
+            self._classvalues_interp = class_values(len(self.breaks)-1, # -1 because break values include edgevalues so will be one more in length
+                                                    self.classvalues)
+        self._classvalues_dirty = False
+
+    def add(self, items):
+        """
+        Adds new items to the classifier and updates the breaks, without recalculating from scratch.
+
+        The first call to add() or remove() builds a sorted index of the item values, which is then
+        maintained incrementally by binary search. Breaks for equal, histogram, log, pretty and stdev are
+        updated exactly from running statistics, and quantile from the sorted index. Headtail is recalculated
+        from the sorted index in linear time, skipping the value extraction and sorting. Natural is recalculated
+        from the sorted index, or if it holds more than `edit_maxsize` values and no maxsize kwarg was given,
+        from random samples of that many values (see `classypie.breaks.natural`), so that each edit has a
+        bounded cost. Call update() to recalculate natural breaks from all the values.
+        Not available for the classifications of a `MultiClassifier`, which all share its items. 
+
+        Args:
+
+        - **items**: A list of items or values to add. 
+        """
+        items = list(items)
+        self._editable_items()
+        with self._profiling("edit"):
+            self._build_index()
+            if self._positions is not None:
+                positions = self._positions
+                for pos,item in enumerate(items, len(self._items)):
+                    positions.setdefault(id(item), []).append(pos)
+            self._items.extend(items)
+            if self._index is not None:
+                values,members,stats = self._index
+                filters = self._filters()
+                for item,val in _valid_pairs(items, self.key, **filters):
+                    i = bisect.bisect_right(values, val)
+                    values.insert(i, val)
+                    members.insert(i, item)
+                    stats.add(val)
+            self._edit()
+
+    def remove(self, items):
+        """
+        Removes items from the classifier and updates the breaks, without recalculating from scratch.
+        See add() for how the breaks are updated.
+
+        Args:
+
+        - **items**: A list of items or values to remove. Each must be in the classifier's items, otherwise
+            ValueError is raised and the classifier is left unchanged.
+        """
+        items = list(items)
+        self._editable_items()
+        with self._profiling("edit"):
+            self._build_index()
+            if self._index is None:
+                # nothing to locate the items by, so remove them from a copy first
+                remaining = list(self.items)
+                for item in items:
+                    remaining.remove(item)
+                self.items[:] = remaining
+                self._positions = None
+                self._edit()
+                return
+
+            # locate all the items in the sorted index before changing anything
+            values,members,stats = self._index
+            filters = self._filters()
+            located = set()
+            unindexed = []
+            for item in items:
+                pairs = list(_valid_pairs([item], self.key, **filters))
+                if not pairs:
+                    # items without a valid value are not in the index
+                    unindexed.append(item)
+                    continue
+                val = pairs[0][1]
+                for i in range(bisect.bisect_left(values, val), bisect.bisect_right(values, val)):
+                    if i not in located and members[i] == item:
+                        located.add(i)
+                        break
+                else:
+                    raise ValueError("%r is not in the classifier items" % (item,))
+
+            # locate the items in the items list, the indexed ones by identity
+            positions = self._item_positions()
+            slots = set()
+            taken = {}
+            for i in located:
+                # the same item may be in the list more than once
+                n = taken.get(id(members[i]), 0)
+                slots.add(positions[id(members[i])][n])
+                taken[id(members[i])] = n + 1
+            for item in unindexed:
+                for pos,other in enumerate(self._items):
+                    if pos not in slots and other is not _REMOVED and other == item:
+                        slots.add(pos)
+                        break
+                else:
+                    raise ValueError("%r is not in the classifier items" % (item,))
+
+            # leave placeholders instead of shifting the remaining items
+            for pos in slots:
+                item = self._items[pos]
+                itempositions = positions[id(item)]
+                itempositions.remove(pos)
+                if not itempositions:
+                    del positions[id(item)]
+                self._items[pos] = _REMOVED
+            self._removed += len(slots)
+            if self._removed > len(self._items) // 2:
+                # mostly placeholders, so dropping them costs less than keeping them
+                self._compact()
+            for i in sorted(located, reverse=True):
+                stats.remove(values[i])
+                del values[i]
+                del members[i]
+            self._edit()
+
+    # the number of values above which natural breaks are updated from samples after each edit
+    edit_maxsize = 10000
+
+    def _editable_items(self):
+        # the items are copied to a new list the first time they are edited,
+        # leaving the caller's list unchanged. The values and so the breaks stay the same.
+        if self._shared:
+            raise Exception("Cannot add or remove items of a MultiClassifier classification, whose items are shared")
+        if not self._owned:
+            items = self._items
+            self._items = list(items.items if isinstance(items, PreparedValues) else items)
+            self._owned = True
+
+    def _item_positions(self):
+        # the positions in items of each item, by id
+        if self._positions is None:
+            self._positions = self._map_positions(self.items)
+        return self._positions
+
+    @staticmethod
+    def _map_positions(items):
+        positions = {}
+        for pos,item in enumerate(items):
+            positions.setdefault(id(item), []).append(pos)
+        return positions
+
+    def _compact(self):
+        # drops the placeholders left by remove(), updating the positions if they are kept
+        self._items[:] = [item for item in self._items if item is not _REMOVED]
+        self._removed = 0
+        if self._positions is not None:
+            self._positions = self._map_positions(self._items)
+
+    def _live_items(self):
+        # the items without the placeholders left by remove(), leaving the items list
+        # and positions as they are so that the next remove() does not have to remap them
+        if self._removed:
+            return [item for item in self._items if item is not _REMOVED]
+        return self._items
+
+    def _filters(self):
+        # the kwargs that filter values
+        return dict((k,v) for k,v in self.kwargs.items() if k in ("exclude","minval","maxval"))
+
+    def _build_index(self):
+        # the valid values in sorted order, along with the item of each value and their stats
+        if self._index is None and self.algo not in ("custom","unique","proportional"):
+            with _profile.stage("index"):
+                pairs = sorted(_valid_pairs(self._live_items(), self.key, **self._filters()), key=lambda pair: pair[1])
+                values = [val for item,val in pairs]
+                members = [item for item,val in pairs]
+                self._index = (values, members, Stats(values))
+                self._positions = None
+
+    def _edit(self):
+        # updates the breaks from the index after items were added or removed
+        if self.algo in ("custom","unique"):
+            return
+        elif self.algo == "proportional":
+            self.update()
+            return
+
+        # the kwargs that go to the algorithm
+        algokwargs = dict((k,v) for k,v in self.kwargs.items() if k not in ("exclude","minval","maxval","extrabreaks","stream","cache"))
+        values,members,stats = self._index
+
+        if not values:
+            raise Exception("No values left to classify")
+
+        with _profile.stage("algorithm"):
+            if self.algo == "stdev" and len(values) <= algokwargs.get("classes", 5):
+                # too few values gives a break at each value, which needs the values and not just their stats
+                newbreaks = _breaks.stdev(values, **algokwargs)
+            elif self.algo in ("equal","histogram","log","pretty","stdev"):
+                stats.min,stats.max = values[0],values[-1]
+                func = _breaks.get_algorithm(self.algo, "python")
+                newbreaks = func(stats, **algokwargs)
+            elif self.algo == "quantile":
+                func = _breaks.get_algorithm(self.algo, "python")
+                newbreaks = func(values, **algokwargs)
+            else:
+                if self.algo == "natural" and not algokwargs.get("maxsize") and len(values) > self.edit_maxsize:
+                    # bounded cost, with fixed samples so that the same values give the same breaks
+                    algokwargs["maxsize"] = self.edit_maxsize
+                    algokwargs.setdefault("seed", 0)
+                func = _breaks.get_algorithm(self.algo, self.engine)
+                newbreaks = func(values, **algokwargs)
+
+        self._breaks = _insert_extrabreaks(newbreaks, self.kwargs.get("extrabreaks"))
+        self._breaks_dirty = False
+        self._classvalues_dirty = True
 
     def __iter__(self):
+        if self._profile is None:
+            return self._iterate()
+        # the work happens while iterating, so collect the results while profiling
+        with self._profiling("iterate"):
+            results = list(self._iterate())
+        return iter(results)
+
+    def _iterate(self):
         # loop and yield items along with their classnum and classvalue
         
         if self.algo == "unique":
             if isinstance(self.classvalues_interp, dict):
                 # only return specified uniqueval-classval pairs
-                for uid,subitems in unique(self.items, key=self.key, **self.kwargs):
+                for uid,subitems in unique(self._live_items(), key=self.key, **self.kwargs):
                     if uid in self.classvalues_interp:
                         classval = self.classvalues_interp[uid]
                         for item in subitems:
@@ -143,13 +498,13 @@ class Classifier(object):
                         for classval in self.classvalues_interp:
                             yield classval
                 classvalgen = classvalgen()
-                for uid,subitems in unique(self.items, key=self.key, **self.kwargs):
+                for uid,subitems in unique(self._live_items(), key=self.key, **self.kwargs):
                     classval = next(classvalgen)
                     for item in subitems:
                         yield item,classval
 
         elif self.algo == "proportional":
-            for item,newval in rescale(self.items,
+            for item,newval in rescale(self._live_items(),
                                        newmin=self.classvalues_interp[0],
                                        newmax=self.classvalues_interp[-1],
                                        key=self.key,
@@ -157,7 +512,8 @@ class Classifier(object):
                 yield item,newval
 
         else:
-            for valrange,subitems in split(self.items, self.breaks, key=self.key, **self.kwargs):
+            # breaks are already known, so no need to sort the items
+            for valrange,subitems in split(self._live_items(), self.breaks, key=self.key, sort=False, **self.kwargs):
                 midval = (valrange[0] + valrange[1]) / 2.0
                 classinfo = self.find_class(midval)
                 if classinfo is not None:
@@ -185,7 +541,168 @@ class Classifier(object):
             enclosing breakpoint values. If value is outside the scope of all breakpoints,
             returns None.
         """
-        return find_class(value, self.breaks)
+        if getattr(self, "_floatbreaks", (None,None))[0] is not self.breaks:
+            # cache the float version of the breaks until they are changed
+            self._floatbreaks = (self.breaks, [float(brk) for brk in self.breaks])
+        i = _find_index(float(value), self._floatbreaks[1])
+        if i is not None:
+            return i+1, (self.breaks[i], self.breaks[i+1])
+
+    def assign(self, classvalues=False):
+        """
+        Assigns each item to its class in a single batch, see `classypie.assign`.
+        Only available for classifications based on breakpoints. 
+
+        Args:
+
+        - **classvalues** (optional): If True, also returns a parallel sequence of the class value of each item.
+
+        Returns:
+
+        - An array of class numbers, one for each item in input order, where 1 is the first class and 0
+            means the item was not classified. If classvalues is True, returns a 2-tuple of the class numbers
+            and the class values, packed as described in `classypie.assign`. 
+        """
+        if self.algo in ("unique","proportional"):
+            raise Exception("assign() is only available for classifications based on breakpoints")
+        kwargs = dict((k,v) for k,v in self.kwargs.items() if k in ("exclude","minval","maxval"))
+        with self._profiling("assign"):
+            return assign(self._live_items(), self.breaks, key=self.key, engine=self.engine,
+                          classvalues=self.classvalues if classvalues else None,
+                          **kwargs)
+
+
+    def summarize(self):
+        """
+        Summarizes the values in each class, see `classypie.summarize`, along with its class value.
+        Only available for classifications based on breakpoints. 
+
+        Returns:
+
+        - A list with one 2-tuple for each class of the class value range and a dictionary with the classvalue,
+            and the count, sum, min, max and mean of the values in that class. 
+        """
+        if self.algo in ("unique","proportional"):
+            raise Exception("summarize() is only available for classifications based on breakpoints")
+        kwargs = dict((k,v) for k,v in self.kwargs.items() if k in ("exclude","minval","maxval"))
+        with self._profiling("summarize"):
+            results = summarize(self._live_items(), self.breaks, key=self.key, engine=self.engine, **kwargs)
+        for (valrange,info),classval in zip(results, self.classvalues_interp):
+            info["classvalue"] = classval
+        return results
+
+
+class MultiClassifier(object):
+    """
+    Manages several classifications of the same items, for instance to style the same
+    data by fill color, size and opacity using different algorithms.
+    The item values are extracted and sorted only once and shared by all the classifications.
+    Iterating yields each item once along with its class value in every classification.
+
+    Attributes:
+
+    - items: The list of items or values managed by the classifier.
+    - key: Function used to extract value from each item, defaults to None and treats item itself as the value.
+    - classifications: Ordered dictionary of classification names and the `Classifier` for each.
+
+    Example:
+
+        >>> cfier = classypie.MultiClassifier(items)
+        >>> cfier.add_classification("fill", breaks="natural", classvalues=[(0,255,0),(255,0,0)])
+        >>> cfier.add_classification("size", breaks="equal", classvalues=[1,10])
+        >>> for item,info in cfier:
+        >>>     info["fill"], info["size"]
+    """
+
+    def __init__(self, items, key=None):
+        """
+        Args:
+
+        - **items**: The list of items or values to classify, or a `PreparedValues` of them.
+        - **key** (optional): Function used to extract value from each item, defaults to None and treats item itself as the value.
+        """
+        if isinstance(items, PreparedValues):
+            prepared = items
+        else:
+            prepared = PreparedValues(items, key=key)
+        self.items = prepared.items
+        self.key = prepared.key
+        self.classifications = OrderedDict()
+        self._prepared = {prepared.key: prepared}
+
+    def __repr__(self):
+        return "MultiClassifier object:\n" + "\n".join("%s: %r" % (name,cfier) for name,cfier in self.classifications.items())
+
+    def __getitem__(self, name):
+        return self.classifications[name]
+
+    def add_classification(self, name, breaks, classvalues, key=None, engine=None, **kwargs):
+        """
+        Adds a named classification of the items.
+
+        Args:
+
+        - **name**: The name used to identify the classification.
+        - **breaks**, **classvalues**, **engine** and **kwargs**: See `Classifier`.
+        - **key** (optional): Function used to extract value from each item, if different from the
+            key of the MultiClassifier. 
+
+        Returns:
+
+        - The `Classifier` for the new classification. 
+        """
+        key = key or self.key
+        if key not in self._prepared:
+            self._prepared[key] = PreparedValues(self.items, key=key)
+        cfier = Classifier(self._prepared[key], breaks, classvalues, engine=engine, **kwargs)
+        cfier._shared = True
+        self.classifications[name] = cfier
+        return cfier
+
+    def _classvalues(self, cfier):
+        # the class value of each item in input order, or None if not classified
+        classvals = [None] * len(self.items)
+        prepared = cfier.items
+
+        if cfier.algo == "unique":
+            numbered = list(enumerate(self.items))
+            key = cfier.key or (lambda x: x)
+            if isinstance(cfier.classvalues_interp, dict):
+                for uid,members in unique(numbered, key=lambda pair: key(pair[1]), **cfier.kwargs):
+                    if uid in cfier.classvalues_interp:
+                        for i,_ in members:
+                            classvals[i] = cfier.classvalues_interp[uid]
+            else:
+                classvalcycle = itertools.cycle(cfier.classvalues_interp)
+                for uid,members in unique(numbered, key=lambda pair: key(pair[1]), **cfier.kwargs):
+                    classval = next(classvalcycle)
+                    for i,_ in members:
+                        classvals[i] = classval
+
+        elif cfier.algo == "proportional":
+            numbered = list(zip(prepared.positions, prepared.values))
+            for (i,_),newval in rescale(numbered,
+                                        newmin=cfier.classvalues_interp[0],
+                                        newmax=cfier.classvalues_interp[-1],
+                                        key=lambda pair: pair[1],
+                                        **cfier.kwargs):
+                classvals[i] = newval
+
+        else:
+            filters = dict((k,v) for k,v in cfier.kwargs.items() if k in ("exclude","minval","maxval"))
+            classnums = assign(prepared, cfier.breaks, engine=cfier.engine, **filters)
+            for i,classnum in enumerate(classnums.tolist()):
+                if classnum:
+                    classvals[i] = cfier.classvalues_interp[classnum-1]
+
+        return classvals
+
+    def __iter__(self):
+        # loop and yield each item along with a dict of its classvalue in each classification
+        names = list(self.classifications.keys())
+        columns = [self._classvalues(self.classifications[name]) for name in names]
+        for i,item in enumerate(self.items):
+            yield item, dict((name,column[i]) for name,column in zip(names,columns))
 
 
 ################################
@@ -199,6 +716,10 @@ def find_class(value, breaks):
     the breakpoints, ie larger or smaller than the break endpoints, is considered
     to be a miss and returns None.
 
+    A value that equals a breakpoint belongs to the class starting at that breakpoint,
+    except for the last breakpoint which is included in the last class. Two duplicate
+    breakpoints define a class containing only that exact value. 
+
     Args:
 
     - **value**: The value for which to find the class. 
@@ -210,17 +731,24 @@ def find_class(value, breaks):
         enclosing breakpoint values. If value is outside the scope of all breakpoints,
         returns None. 
     """
-    
-    prevbrk = breaks[0]
-    classnum = 1
-    for nextbrk in breaks[1:]:
-        if eval(bytes(prevbrk)) <= eval(bytes(value)) <= eval(bytes(nextbrk)):
-            return classnum, (prevbrk,nextbrk)
-        prevbrk = nextbrk
-        classnum += 1
-    else:
-        # Value was not within the range of the break points
+    i = _find_index(float(value), [float(brk) for brk in breaks])
+    if i is not None:
+        return i+1, (breaks[i], breaks[i+1])
+
+def _find_index(value, breaks):
+    # Zero-based index of the class that a float value belongs to, given a list of float breaks,
+    # or None if outside the breaks. Each class includes its lower break but not its upper break,
+    # except for the last class which includes both, and duplicate breaks which form a class
+    # containing only that single value.
+    if not breaks[0] <= value <= breaks[-1]:
+        # also catches nan
         return None
+    hi = bisect.bisect_right(breaks, value)
+    lo = bisect.bisect_left(breaks, value, 0, hi)
+    if hi - lo > 1:
+        # duplicate breaks, single-value class
+        return lo
+    return min(hi, len(breaks)-1) - 1
 
 def class_values(classes, valuestops):
     """
@@ -300,13 +828,21 @@ def class_values(classes, valuestops):
 
     return classvalues
 
-def breaks(items, algorithm, key=None, extrabreaks=None, exclude=None, minval=None, maxval=None, **kwargs):
+def breaks(items, algorithm, key=None, extrabreaks=None, exclude=None, minval=None, maxval=None, engine=None, stream=False, cache=None, **kwargs):
     """
     Given a list of items or values, classify into groups and get their break points, including the start and endpoint.
 
     Args:
 
-    - **items**: The list of items or values to classify.
+    - **items**: The list of items or values to classify, or a `PreparedValues` of them. Can also be a `QuantileSketch`
+        or `Stats` summary of already streamed values, in which case key, exclude, minval and maxval are not used. 
+        Values stored in an `array.array`, `memoryview`, `mmap` (read as raw float64, see `open_values`) or 1-D numpy
+        array are read directly when no key is given, rather than item by item. The numpy engine reads them in place,
+        copying them only when the algorithm needs them sorted. The python engine converts them to a list of floats
+        in a single call, except for the equal, histogram, log, pretty and stdev algorithms, which read them in a
+        single pass without a list. 
+        Can also be a `FrequencyTable` of the distinct values and their counts, which gives the same breaks
+        as the expanded values, in which case key is not used. 
     - **algorithm**: Name of the classification algorithm to use.
         Valid names are:
         - histogram (alias for equal)
@@ -325,6 +861,13 @@ def breaks(items, algorithm, key=None, extrabreaks=None, exclude=None, minval=No
     - **exclude** (optional): A list of values defining which values to exclude.
     - **minval** (optional): Sets the lower value boundary for the classification groupings, ignoring values below this threshold.
     - **maxval** (optional): Sets the upper value boundary for the classification groupings, ignoring values above this threshold.
+    - **engine** (optional): The engine used to calculate the breaks, either 'python' or 'numpy'.
+        Defaults to None, which uses numpy if it is installed and pure Python otherwise.
+    - **stream** (optional): If True, consumes the items in a single pass without sorting or keeping them in memory.
+        Only supported for the 'equal', 'histogram', 'log', 'pretty' and 'stdev' algorithms, which are calculated
+        exactly from a `Stats` accumulator, and 'quantile', which returns approximate breaks from a `QuantileSketch`.
+        To combine separately processed partitions, or for more control over the quantile accuracy,
+        create and merge these objects and pass them as the items instead. 
     - **kwargs** (optional): Depending on the breaks algorithm used, any remaining kwargs are passed to the algorithm function.
         The algorithm functions and their arguments can be found in `classypie.breaks`.
 
@@ -333,34 +876,188 @@ def breaks(items, algorithm, key=None, extrabreaks=None, exclude=None, minval=No
     - List of break points calculated for this algorithm in increasing order, i.e. the dividing lines between groupings. 
     """
 
-    # ensure values are numeric
-    def forcenumber(val):
-        try:
-            val = float(val)
-            return val
-        except:
-            return None
-    
-    # sort by key
-    if key:
-        keywrap = lambda x: forcenumber(key(x))
+    engine = _breaks.get_engine(engine)
+    if cache is True:
+        cache = _cache.default_cache
+    elif cache is False:
+        cache = None
+
+    unordered = False
+    if isinstance(items, (QuantileSketch,Stats)):
+        # values have already been streamed
+        values = items
+        cache = None
+
+    elif isinstance(items, FrequencyTable):
+        # the algorithms work directly on the distinct values and their counts
+        with _profile.stage("extract"):
+            values = items.select(exclude=exclude, minval=minval, maxval=maxval)
+        cache = None
+
+    elif isinstance(items, PreparedValues):
+        # values have already been extracted and sorted. Too few values for stdev
+        # gives a break at each value, which needs the values and not just their stats
+        if algorithm in _STATS_ALGORITHMS and exclude is None and minval is None and maxval is None \
+           and not (algorithm == "stdev" and len(items) <= kwargs.get("classes", 5)):
+            values = items.stats
+            cache = None
+        else:
+            with _profile.stage("extract"):
+                values = items.select(exclude=exclude, minval=minval, maxval=maxval)
+            if cache is not None:
+                fingerprint = _cache.fingerprint(values)
+            if engine == "numpy":
+                import numpy
+                values = numpy.frombuffer(values, dtype=numpy.float64)
+
+    elif stream:
+        # consume values in a single pass
+        if algorithm in _STATS_ALGORITHMS:
+            values = Stats()
+        elif algorithm == "quantile":
+            values = QuantileSketch()
+        else:
+            raise Exception("stream=True is not supported for the %s algorithm" % algorithm)
+        with _profile.stage("extract"):
+            values.extend(_valid_values(items, key, exclude, minval, maxval))
+        cache = None
+
     else:
-        keywrap = forcenumber
-        
-    items = (item for item in items if keywrap(item) is not None)
-    if exclude is not None:
-        if not isinstance(exclude, (list,tuple)): exclude = [exclude]
-        items = (item for item in items if keywrap(item) not in exclude)
-    if minval is not None: items = (item for item in items if keywrap(item) >= minval)
-    if maxval is not None: items = (item for item in items if keywrap(item) <= maxval)
-    items = sorted(items, key=keywrap)
-    values = [keywrap(item) for item in items]
+        # only the values are needed, not the items
+        with _profile.stage("extract"):
+            # buffers and numpy arrays are read directly, in place for the numpy engine and
+            # in a single pass without a list of the values for the python stats algorithms
+            streamed = engine != "numpy" and algorithm in _STATS_ALGORITHMS
+            values = _column(items, engine, exclude, minval, maxval, stream=streamed) if key is None else None
+            shared = values is not None and engine == "numpy"
+            if values is None:
+                streamed = False
+                if engine == "numpy":
+                    import numpy
+                    values = numpy.fromiter(_valid_values(items, key, exclude, minval, maxval), dtype=numpy.float64)
+                else:
+                    values = list(_valid_values(items, key, exclude, minval, maxval))
+            elif streamed:
+                values = Stats(values)
+                if algorithm == "stdev" and values.count <= kwargs.get("classes", 5):
+                    # too few values gives a break at each value, which needs the values and not just their stats
+                    values = _column(items, engine, exclude, minval, maxval)
+        if streamed:
+            # nothing to gain from caching single pass breaks
+            cache = None
+        elif cache is not None:
+            # lookup before sorting the values
+            fingerprint = _cache.fingerprint(values)
+        unordered = not streamed
+
+    if cache is not None:
+        if algorithm == "natural" and kwargs.get("maxsize") and kwargs.get("seed") is None:
+            kwargs["seed"] = fingerprint
+        cachekey = _cache.make_key(fingerprint, algorithm, engine=engine, extrabreaks=extrabreaks,
+                                   exclude=exclude, minval=minval, maxval=maxval, **kwargs)
+        cached = cache.get(cachekey)
+        if cached is not None:
+            _profile.count("cache_hits")
+            return cached
+        _profile.count("cache_misses")
+
+    if unordered:
+        with _profile.stage("sort"):
+            if shared and _breaks.get_requirement(algorithm) != "stats":
+                # the values are sorted in place, so must not be those of the items
+                values = values.copy()
+            values = _order_values(values, algorithm, engine, **kwargs)
 
     # get breaks
-    func = _breaks.__dict__[algorithm]
-    breaks = func(values, **kwargs)
+    func = _breaks.get_algorithm(algorithm, engine)
+    with _profile.stage("algorithm"):
+        breaks = func(values, **kwargs)
 
     # insert extra breaks (list of single break values or pairs)
+    breaks = _insert_extrabreaks(breaks, extrabreaks)
+
+    if cache is not None:
+        cache.put(cachekey, breaks)
+    
+    return breaks
+
+_STATS_ALGORITHMS = ("equal","histogram","log","pretty","stdev")
+
+def _order_values(values, algorithm, engine, **kwargs):
+    # orders the list or numpy array of values in place only as much as the algorithm needs
+    requirement = _breaks.get_requirement(algorithm)
+    if requirement == "stats":
+        # the value range and moments are found in single passes over the unsorted values
+        return values
+    if requirement == "order" and engine == "numpy":
+        # only move the needed order statistics into their sorted positions, in linear time.
+        # pure python has no selection that beats the builtin sort, so it sorts instead.
+        ranks = _breaks.get_ranks(algorithm, len(values), **kwargs)
+        if ranks is not None:
+            values.partition(ranks)
+            return values
+    values.sort()
+    return values
+
+def _algorithm_breaks(values, algorithm, engine, **kwargs):
+    # calculates the breaks of an algorithm from a list or numpy array of values in any order,
+    # leaving them unchanged. Only a copy is ordered, and only as much as the algorithm needs.
+    engine = _breaks.get_engine(engine)
+    if _breaks.get_requirement(algorithm) != "stats":
+        with _profile.stage("sort"):
+            if engine == "numpy":
+                import numpy
+                values = numpy.array(values, dtype=numpy.float64)
+            else:
+                values = list(values)
+            values = _order_values(values, algorithm, engine, **kwargs)
+    func = _breaks.get_algorithm(algorithm, engine)
+    with _profile.stage("algorithm"):
+        return func(values, **kwargs)
+
+def _valid_pairs(items, key=None, exclude=None, minval=None, maxval=None, sort=False):
+    # yields each item that passes the filters along with its numeric value,
+    # extracting the value only once per item
+    if isinstance(items, PreparedValues):
+        for pair in items.pairs(exclude=exclude, minval=minval, maxval=maxval, sort=sort):
+            yield pair
+        return
+    if sort:
+        for pair in sorted(_valid_pairs(items, key, exclude, minval, maxval), key=lambda pair: pair[1]):
+            yield pair
+        return
+    if exclude is not None:
+        if not isinstance(exclude, (list,tuple)): exclude = [exclude]
+    seen = rejected = filtered = 0
+    try:
+        for item in items:
+            seen += 1
+            # errors raised by the key itself are not caught
+            val = key(item) if key else item
+            try:
+                val = float(val)
+            except:
+                rejected += 1
+                continue
+            if (exclude is not None and val in exclude) \
+               or (minval is not None and val < minval) \
+               or (maxval is not None and val > maxval):
+                filtered += 1
+                continue
+            yield item, val
+    finally:
+        if _profile.active():
+            _profile.count("items", seen)
+            _profile.count("rejected", rejected)
+            _profile.count("filtered", filtered)
+
+def _valid_values(items, key=None, exclude=None, minval=None, maxval=None):
+    # yields the numeric values of items that pass the filters, in input order
+    if isinstance(items, PreparedValues) and exclude is None and minval is None and maxval is None:
+        return iter(items.values)
+    return (val for item,val in _valid_pairs(items, key, exclude, minval, maxval))
+
+def _insert_extrabreaks(breaks, extrabreaks):
     if extrabreaks:
         for val in extrabreaks:
             oldbreaks = list(breaks)
@@ -371,15 +1068,14 @@ def breaks(items, algorithm, key=None, extrabreaks=None, exclude=None, minval=No
             i = 0
             for nextbrk in oldbreaks[1:]:
                 if prevbrk <= val < nextbrk:
-                    breaks.insert(i, val)
+                    breaks.insert(i+1, val)
                     break
                 else:
                     prevbrk = nextbrk
                 i += 1
-    
     return breaks
 
-def split(items, breaks, key=None, exclude=None, minval=None, maxval=None, **kwargs):
+def split(items, breaks, key=None, exclude=None, minval=None, maxval=None, engine=None, sort=True, **kwargs):
     """
     Splits a list of items into n non-overlapping classes based on the
     specified algorithm. Values are either the items themselves or
@@ -387,7 +1083,11 @@ def split(items, breaks, key=None, exclude=None, minval=None, maxval=None, **kwa
 
     Args:
 
-    - **items**: The list of items or values to classify.
+    - **items**: The list of items or values to classify, or a `PreparedValues` of them. Values stored in an `array.array`,
+        `memoryview`, `mmap` (read as raw float64, see `open_values`) or 1-D numpy array are read directly when no key
+        is given, in place with the numpy engine and converted to a list of floats in a single call with the python engine.
+        If sort is True, each group is then sliced from the sorted values at the breaks. Can also be a `FrequencyTable`,
+        in which case the members of each group are the (value, count) tuples of its distinct values. 
     - **breaks**: List of custom break values, or the name of the algorithm to use.
         Valid names are:
         - histogram (alias for equal)
@@ -406,6 +1106,11 @@ def split(items, breaks, key=None, exclude=None, minval=None, maxval=None, **kwa
     - **exclude** (optional): A list of values defining which values to exclude.
     - **minval** (optional): Sets the lower value boundary for the classification groupings, ignoring values below this threshold.
     - **maxval** (optional): Sets the upper value boundary for the classification groupings, ignoring values above this threshold.
+    - **engine** (optional): The engine used to calculate the breaks if an algorithm name is given, either 'python' or 'numpy'.
+        Defaults to None, which uses numpy if it is installed and pure Python otherwise.
+    - **sort** (optional): If True (default), items are sorted by value, so the items of each group are in increasing
+        order. If False, the items are assigned to their groups in a single pass without sorting, keeping their
+        original input order within each group, which is much faster for large lists of items. 
     - **kwargs** (optional): Depending on the breaks algorithm used, any remaining kwargs are passed to the algorithm function.
         The algorithm functions and their arguments can be found in `classypie.breaks`.
 
@@ -415,125 +1120,480 @@ def split(items, breaks, key=None, exclude=None, minval=None, maxval=None, **kwa
         items belonging to that group. 
     """
 
-    # ensure values are numeric
-    def forcenumber(val):
-        try:
-            val = float(val)
-            return val
-        except:
-            return None
-
-    # sort and get key
-    if key:
-        keywrap = lambda x: forcenumber(key(x))
+    if isinstance(items, FrequencyTable):
+        for group in _split_table(items.select(exclude, minval, maxval), breaks, engine, **kwargs):
+            yield group
+        return
+
+    if key is None:
+        # buffers of values can be handled as a whole
+        engine = _breaks.get_engine(engine)
+        with _profile.stage("extract"):
+            values = _column(items, engine, exclude, minval, maxval)
+        if values is not None:
+            for group in _split_column(values, breaks, engine, sort, **kwargs):
+                yield group
+            return
+
+    # get item values, optionally sorted
+    if sort:
+        with _profile.stage("extract"):
+            # prepared values already know their sort order
+            presorted = isinstance(items, PreparedValues)
+            pairs = list(_valid_pairs(items, key, exclude, minval, maxval, sort=presorted))
+        if not presorted:
+            with _profile.stage("sort"):
+                pairs.sort(key=lambda pair: pair[1])
+        values = [val for item,val in pairs]
     else:
-        keywrap = forcenumber
-        
-    items = (item for item in items if keywrap(item) is not None)
-    if exclude is not None:
-        if not isinstance(exclude, (list,tuple)): exclude = [exclude]
-        items = (item for item in items if keywrap(item) not in exclude)
-    if minval is not None: items = (item for item in items if keywrap(item) >= minval)
-    if maxval is not None: items = (item for item in items if keywrap(item) <= maxval)
-    items = sorted(items, key=keywrap)
-    values = [keywrap(item) for item in items]
+        pairs = _valid_pairs(items, key, exclude, minval, maxval)
 
     # if not custom specified, get break values from algorithm name
-    if isinstance(breaks, bytes):
-        func = _breaks.__dict__[breaks]
-        breaks = func(values, **kwargs)
+    if isinstance(breaks, _string_types):
+        if sort:
+            func = _breaks.get_algorithm(breaks, engine)
+            with _profile.stage("algorithm"):
+                breaks = func(values, **kwargs)
+        else:
+            # the algorithm may still need ordered values, but not sorted items
+            with _profile.stage("extract"):
+                pairs = list(pairs)
+            breaks = _algorithm_breaks([val for item,val in pairs], breaks, engine, **kwargs)
     else:
         # custom specified breakpoints
         breaks = list(breaks)
 
-    breaks_gen = (brk for brk in breaks)
-    loopdict = dict()
-    loopdict["prevbrk"] = next(breaks_gen)
-    loopdict["nextbrk"] = next(breaks_gen)
+    floatbreaks = [float(brk) for brk in breaks]
+
+    if not sort:
+        # bucket each item directly by its class index
+        buckets = [[] for _ in range(len(breaks)-1)]
+        with _profile.stage("classify"):
+            for item,val in pairs:
+                i = _find_index(val, floatbreaks)
+                if i is not None:
+                    buckets[i].append(item)
+        for i,members in enumerate(buckets):
+            if members:
+                yield (breaks[i],breaks[i+1]), members
+        return
+
+    def find_class(pair):
+        i = _find_index(pair[1], floatbreaks)
+        if i is not None:
+            return breaks[i],breaks[i+1]
+
+    with _profile.stage("classify"):
+        groups = [(valrange, [item for item,val in members])
+                  for valrange,members in itertools.groupby(pairs, key=find_class)
+                  if valrange is not None]
+    for valrange,members in groups:
+        yield valrange, members
+
+def _split_column(values, breaks, engine, sort, **kwargs):
+    # split for a list or numpy array of values, see _column
+    if sort:
+        with _profile.stage("sort"):
+            if engine == "numpy":
+                import numpy
+                sortedvalues = numpy.sort(values)
+            else:
+                sortedvalues = sorted(values)
+    if isinstance(breaks, _string_types):
+        if sort:
+            func = _breaks.get_algorithm(breaks, engine)
+            with _profile.stage("algorithm"):
+                breaks = func(sortedvalues, **kwargs)
+        else:
+            breaks = _algorithm_breaks(values, breaks, engine, **kwargs)
+    else:
+        breaks = list(breaks)
+    floatbreaks = [float(brk) for brk in breaks]
+    classes = len(breaks) - 1
+
+    with _profile.stage("classify"):
+        groups = []
+        if sort:
+            # the class never decreases with the value, so each class is a run of the sorted values
+            starts = _class_starts(sortedvalues, floatbreaks)
+            for i in range(classes):
+                if starts[i] < starts[i+1]:
+                    members = sortedvalues[starts[i]:starts[i+1]]
+                    groups.append(((breaks[i],breaks[i+1]), members if isinstance(members, list) else members.tolist()))
+        elif engine == "numpy":
+            # group the values by class number, keeping their input order within each class
+            import numpy
+            classnums = _np_classnums(values, floatbreaks)
+            counts = numpy.bincount(classnums, minlength=classes+1)
+            ends = numpy.cumsum(counts)
+            grouped = values[numpy.argsort(classnums, kind="stable")]
+            for i in range(classes):
+                if counts[i+1]:
+                    groups.append(((breaks[i],breaks[i+1]), grouped[ends[i]:ends[i+1]].tolist()))
+        else:
+            buckets = [[] for _ in range(classes)]
+            for val in values:
+                i = _find_index(val, floatbreaks)
+                if i is not None:
+                    buckets[i].append(val)
+            groups = [((breaks[i],breaks[i+1]), members) for i,members in enumerate(buckets) if members]
+    return groups
+
+def _split_table(table, breaks, engine, **kwargs):
+    # split for a FrequencyTable, whose distinct values are already sorted
+    if isinstance(breaks, _string_types):
+        func = _breaks.get_algorithm(breaks, engine)
+        with _profile.stage("algorithm"):
+            breaks = func(table, **kwargs)
+    else:
+        breaks = list(breaks)
+    floatbreaks = [float(brk) for brk in breaks]
+
+    with _profile.stage("classify"):
+        values,counts = table.values,table.counts
+        starts = _class_starts(values, floatbreaks)
+        groups = []
+        for i in range(len(breaks)-1):
+            if starts[i] < starts[i+1]:
+                members = list(zip(values[starts[i]:starts[i+1]], counts[starts[i]:starts[i+1]]))
+                groups.append(((breaks[i],breaks[i+1]), members))
+    return groups
+
+def _class_starts(values, floatbreaks):
+    # the position in the sorted values where each class starts, followed by where the last
+    # class ends, found by binary search since the class index never decreases with the value
+    classes = len(floatbreaks) - 1
+    def rank(val):
+        i = _find_index(val, floatbreaks)
+        if i is None:
+            return -1 if val < floatbreaks[0] else classes
+        return i
+    starts = []
+    lo = 0
+    for c in range(classes+1):
+        hi = len(values)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if rank(float(values[mid])) < c:
+                lo = mid + 1
+            else:
+                hi = mid
+        starts.append(lo)
+    return starts
+
+def assign(items, breaks, key=None, exclude=None, minval=None, maxval=None, classvalues=None, engine=None, **kwargs):
+    """
+    Assigns each item to its class in a single batch, returning a compact array of class numbers
+    in the same order as the input items, rather than grouping the items like `split`. 
+    Uses the same boundary rules as `find_class`.
 
-    def find_class(item, loopdict=loopdict):
-        val = keywrap(item)
-        
-##        while eval(bytes(val)) > eval(bytes(loopdict["nextbrk"])):
-##            loopdict["prevbrk"] = loopdict["nextbrk"]
-##            loopdict["nextbrk"] = next(breaks_gen)
-##        if eval(bytes(loopdict["prevbrk"])) <= eval(bytes(val)) <= eval(bytes(loopdict["nextbrk"])):
-##            return loopdict["prevbrk"],loopdict["nextbrk"]
-        
-##        if eval(bytes(val)) < loopdict["prevbrk"]:
-##            # value lower than first class
-##            return None
-##        else:
-##            while not (eval(bytes(loopdict["prevbrk"])) <= eval(bytes(val)) <= eval(bytes(loopdict["nextbrk"]))):
-##                print eval(bytes(loopdict["prevbrk"])) , eval(bytes(val)) , eval(bytes(loopdict["nextbrk"]))
-##                # increment breaks until value is between
-##                loopdict["prevbrk"] = loopdict["nextbrk"]
-##                loopdict["nextbrk"] = next(breaks_gen, None)
-##                if loopdict["nextbrk"] == None:
-##                    return None
-##            # supposedly in between, so test and return class range
-##            if eval(bytes(loopdict["prevbrk"])) <= eval(bytes(val)) < eval(bytes(loopdict["nextbrk"])):
-##                return loopdict["prevbrk"],loopdict["nextbrk"]
-
-        prevbrk = breaks[0]
-        for i,nextbrk in enumerate(breaks[1:]):
-            ###print val,i+1,len(breaks)-1
-            if eval(bytes(val)) < eval(bytes(prevbrk)):
-                return None
-            elif eval(bytes(prevbrk)) <= eval(bytes(val)) < eval(bytes(nextbrk)):
-                return prevbrk,nextbrk
-            elif eval(bytes(prevbrk)) == eval(bytes(val)) == eval(bytes(nextbrk)):
-                return prevbrk,nextbrk
-            elif i+1==len(breaks)-1 and eval(bytes(val)) <= eval(bytes(nextbrk)):
-                return prevbrk,nextbrk
-            prevbrk = nextbrk
+    Args:
+
+    - **items**: The list of items or values to classify, or a `PreparedValues` of them. Values stored in a buffer
+        or 1-D numpy array are read directly when no key is given, as described for `split`. 
+    - **breaks**: List of custom break values, or the name of the algorithm to use.
+        See `split` for valid names. 
+    - **key** (optional): Function used to extract value from each item, defaults to None and treats item itself as the value.
+    - **exclude** (optional): A list of values defining which values to exclude.
+    - **minval** (optional): Sets the lower value boundary for the classification groupings, ignoring values below this threshold.
+    - **maxval** (optional): Sets the upper value boundary for the classification groupings, ignoring values above this threshold.
+    - **classvalues** (optional): A gradient of symbolic values to assign to each of the classes, see `class_values`.
+        If given, also returns the interpolated class value of each item. 
+    - **engine** (optional): Either 'python' or 'numpy'. Defaults to None, which uses numpy if it is installed
+        and pure Python otherwise.
+    - **kwargs** (optional): Depending on the breaks algorithm used, any remaining kwargs are passed to the algorithm function.
+        The algorithm functions and their arguments can be found in `classypie.breaks`.
+
+    Returns:
+
+    - An array of class numbers, one for each input item, where 1 is the first class and 0 means the item
+        was excluded or outside the breaks. With the python engine this is an `array.array('H')`, with the
+        numpy engine a uint16 numpy array.
+        If classvalues is given, returns a 2-tuple of the class numbers and the class value of each item, with nan
+        for unclassified items. These are float64, in an `array.array('d')` with the python engine and a numpy array
+        with the numpy engine. For sequence classvalues, such as rgb colors, the python engine packs the channels of
+        each item one after another, like `rescale_buffer`, while the numpy engine returns an array of shape (n, channels). 
+    """
+
+    # values in input order, with None (nan for the numpy engine) for any that should not be classified
+    engine = _breaks.get_engine(engine)
+    filtered = exclude is not None or minval is not None or maxval is not None
+    with _profile.stage("extract"):
+        # buffers and numpy arrays are read directly, reading the values only once for custom breaks
+        streamed = not isinstance(breaks, _string_types) and not filtered
+        values = _column(items, engine, stream=streamed) if key is None else None
+        mask = None
+        if values is not None:
+            if not filtered:
+                pass
+            elif engine == "numpy":
+                # the values may be those of the items, so are masked rather than changed
+                mask = _mask(values, exclude, minval, maxval)
+            else:
+                if exclude is not None:
+                    if not isinstance(exclude, (list,tuple)): exclude = [exclude]
+                values = [None if (exclude is not None and val in exclude)
+                                  or (minval is not None and val < minval)
+                                  or (maxval is not None and val > maxval)
+                          else val
+                          for val in values]
         else:
-            return None
+            if isinstance(items, PreparedValues):
+                numbered = zip(items.positions, items.values)
+                numbered = _valid_pairs(numbered, lambda pair: pair[1], exclude, minval, maxval)
+                values = [None] * len(items.items)
+            else:
+                items = list(items)
+                numbered = _valid_pairs(enumerate(items), lambda pair: key(pair[1]) if key else pair[1], exclude, minval, maxval)
+                values = [None] * len(items)
+            for (i,_),val in numbered:
+                values[i] = val
+            if engine == "numpy":
+                import numpy
+                values = numpy.array([numpy.nan if val is None else val for val in values], dtype=numpy.float64)
+                mask = ~numpy.isnan(values)
+
+    # if not custom specified, get break values from algorithm name
+    if isinstance(breaks, _string_types):
+        if engine == "numpy":
+            valid = values if mask is None else values[mask]
+        else:
+            valid = [val for val in values if val is not None]
+        breaks = _algorithm_breaks(valid, breaks, engine, **kwargs)
+    floatbreaks = [float(brk) for brk in breaks]
+    if len(floatbreaks)-1 > 65535:
+        raise Exception("Cannot assign more than 65535 classes")
+
+    with _profile.stage("classify"):
+        if engine == "numpy":
+            import numpy
+            classnums = _np_classnums(values, floatbreaks)
+            if mask is not None:
+                classnums[~mask] = 0
+        else:
+            classnums = array.array('H')
+            for val in values:
+                index = _find_index(val, floatbreaks) if val is not None else None
+                classnums.append(index + 1 if index is not None else 0)
+
+    if classvalues is None:
+        return classnums
+
+    # lookup class values by class number, with a leading entry for unclassified
+    with _profile.stage("classvalues"):
+        interp = class_values(len(floatbreaks)-1, classvalues)
+        if engine == "numpy":
+            table = numpy.array(interp, dtype=numpy.float64)
+            table = numpy.concatenate((numpy.full((1,)+table.shape[1:], numpy.nan), table))
+            values = table[classnums]
+        elif all(hasattr(classval, "__iter__") for classval in interp):
+            # the channels of each item one after another, as in rescale_buffer
+            table = [[float('nan')] * len(interp[0])] + [[float(val) for val in classval] for classval in interp]
+            values = array.array('d', itertools.chain.from_iterable(table[classnum] for classnum in classnums))
+        else:
+            table = [float('nan')] + interp
+            values = array.array('d', (table[classnum] for classnum in classnums))
+    return classnums, values
 
-    for valrange,members in itertools.groupby(items, key=find_class):
-        if valrange is not None:
-            yield valrange, list(members)
+def summarize(items, breaks, key=None, exclude=None, minval=None, maxval=None, engine=None, **kwargs):
+    """
+    Summarizes the values of the items in each class, eg for legends and histograms, in a single
+    pass that only keeps the running statistics of each class rather than the member items
+    like `split`. Uses the same boundary rules as `find_class`.
+
+    Example:
+
+        >>> for valrange,info in classypie.summarize(items, breaks, key=lambda f: f["population"]):
+        >>>     valrange, info["count"], info["mean"]
 
-def unique(items, key=None, only=None, exclude=None):
+    Args:
+
+    - **items**: The list of items or values to summarize, or a `PreparedValues` of them.
+    - **breaks**: List of custom break values, or the name of the algorithm to use. See `split` for valid names.
+        If an algorithm name is given, the values (but not the items) are first collected in memory
+        to calculate the breaks. 
+    - **key** (optional): Function used to extract value from each item, defaults to None and treats item itself as the value.
+    - **exclude** (optional): A list of values defining which values to exclude.
+    - **minval** (optional): Ignores values below this threshold.
+    - **maxval** (optional): Ignores values above this threshold.
+    - **engine** (optional): Either 'python' or 'numpy'. Defaults to None, which uses numpy if it is installed
+        and pure Python otherwise.
+    - **kwargs** (optional): Depending on the breaks algorithm used, any remaining kwargs are passed to the algorithm function.
+        The algorithm functions and their arguments can be found in `classypie.breaks`.
+
+    Returns:
+
+    - A list with one 2-tuple for each class, including empty ones, of the class value range and a dictionary with
+        the count, sum, min, max and mean of the values in that class. The min, max and mean of empty classes are None. 
+    """
+    engine = _breaks.get_engine(engine)
+    if engine == "numpy":
+        import numpy
+    with _profile.stage("extract"):
+        # custom breaks only need a single pass over the values
+        streamed = not isinstance(breaks, _string_types)
+        values = _column(items, engine, exclude, minval, maxval, stream=streamed) if key is None else None
+        if values is None:
+            values = _valid_values(items, key, exclude, minval, maxval)
+            if engine == "numpy":
+                values = numpy.fromiter(values, dtype=numpy.float64)
+            elif isinstance(breaks, _string_types):
+                values = list(values)
+
+    if isinstance(breaks, _string_types):
+        breaks = _algorithm_breaks(values, breaks, engine, **kwargs)
+    floatbreaks = [float(brk) for brk in breaks]
+    classes = len(breaks) - 1
+
+    with _profile.stage("classify"):
+        if engine == "numpy":
+            import numpy
+            classnums = _np_classnums(values, floatbreaks)
+            counts = numpy.bincount(classnums, minlength=classes+1)[1:].tolist()
+            sums = numpy.bincount(classnums, weights=values, minlength=classes+1)[1:].tolist()
+            mins = numpy.full(classes+1, numpy.inf)
+            maxs = numpy.full(classes+1, -numpy.inf)
+            numpy.minimum.at(mins, classnums, values)
+            numpy.maximum.at(maxs, classnums, values)
+            mins = mins[1:].tolist()
+            maxs = maxs[1:].tolist()
+        else:
+            counts = [0] * classes
+            sums = [0.0] * classes
+            mins = [None] * classes
+            maxs = [None] * classes
+            for val in values:
+                i = _find_index(val, floatbreaks)
+                if i is not None:
+                    counts[i] += 1
+                    sums[i] += val
+                    if mins[i] is None or val < mins[i]:
+                        mins[i] = val
+                    if maxs[i] is None or val > maxs[i]:
+                        maxs[i] = val
+
+    results = []
+    for i in range(classes):
+        count = counts[i]
+        info = dict(count=count,
+                    sum=sums[i],
+                    min=mins[i] if count else None,
+                    max=maxs[i] if count else None,
+                    mean=sums[i] / count if count else None)
+        results.append(((breaks[i],breaks[i+1]), info))
+    return results
+
+def _np_classnums(vals, floatbreaks):
+    # vectorized _find_index for a numpy array of values, returning a uint16 array
+    # of 1-based class numbers, with 0 for nan or values outside the breaks
+    import numpy
+    brks = numpy.array(floatbreaks)
+    hi = numpy.searchsorted(brks, vals, side="right")
+    lo = numpy.searchsorted(brks, vals, side="left")
+    index = numpy.where(hi - lo > 1, lo, numpy.minimum(hi, len(brks)-1) - 1)
+    inside = (vals >= brks[0]) & (vals <= brks[-1])
+    return numpy.where(inside, index + 1, 0).astype(numpy.uint16)
+
+def unique(items, key=None, only=None, exclude=None, sort=True):
     """
     Bins all same values together, so all bins are unique.
-    Only for ints or text values.
+    Only for ints or text values, or other hashable values.
+    The items are grouped in a single pass, so only the unique values need to be sorted. 
 
     Args:
 
-    - **items**: The list of items or values to classify.
+    - **items**: The list of items or values to classify, or a `PreparedValues` of them.
     - **key** (optional): Function used to extract value from each item, defaults to None and treats item itself as the value.
     - **only** (optional): A list of values defining which values to include. 
     - **exclude** (optional): A list of values defining which values to exclude. Does not apply if `only` is already specified.
+    - **sort** (optional): If True (default), the unique values are iterated in increasing order, otherwise in the
+        order they are first seen in the items. 
+
+    Returns:
+
+    - Iterates over the unique values, each time yielding a 2-tuple of the unique value and a list of the items
+        with that value, in their input order. 
     """
-    
-    # sort and get key
-    if key:
-        pass
-    else:
-        key = lambda x: x
+    for uniq,members in _unique_groups(items, key, only, exclude, sort, counts=False):
+        yield uniq, members
 
-    if only:
-        items = (item for item in items if key(item) in only)
-    elif exclude:
-        items = (item for item in items if key(item) not in exclude)
+def unique_counts(items, key=None, only=None, exclude=None, sort=True):
+    """
+    Counts the number of items with each unique value, like `unique` but without collecting
+    the items of each group. 
+
+    Args:
+
+    - **items**: The list of items or values to count, or a `PreparedValues` of them.
+    - **key** (optional): Function used to extract value from each item, defaults to None and treats item itself as the value.
+    - **only** (optional): A list of values defining which values to include. 
+    - **exclude** (optional): A list of values defining which values to exclude. Does not apply if `only` is already specified.
+    - **sort** (optional): If True (default), the unique values are iterated in increasing order, otherwise in the
+        order they are first seen in the items. 
 
-    items = sorted(items, key=key)
+    Returns:
 
-    for uniq,members in itertools.groupby(items, key=key):
-        yield uniq, list(members)
+    - Iterates over the unique values, each time yielding a 2-tuple of the unique value and the number of items
+        with that value. 
+    """
+    for uniq,count in _unique_groups(items, key, only, exclude, sort, counts=True):
+        yield uniq, count
 
-    # maybe add remaining groups if none?
-    # ... 
+def _unique_groups(items, key, only, exclude, sort, counts):
+    # groups the items, or counts them if counts is True, by their hashable values in a single pass
+    if isinstance(items, PreparedValues):
+        key = items.key
+        items = items.items
+
+    if only:
+        only = set(only)
+        exclude = None
+    elif exclude:
+        only = None
+        exclude = set(exclude)
+    else:
+        only = exclude = None
+
+    if counts:
+        values = (key(item) for item in items) if key else items
+        if only is not None:
+            values = (val for val in values if val in only)
+        elif exclude is not None:
+            values = (val for val in values if val not in exclude)
+        if sort:
+            groups = Counter(values)
+        else:
+            # keep the order the values are first seen
+            groups = OrderedDict()
+            for val in values:
+                groups[val] = groups.get(val, 0) + 1
+    else:
+        groups = OrderedDict() if not sort else {}
+        for item in items:
+            val = key(item) if key else item
+            if only is not None and val not in only: continue
+            if exclude is not None and val in exclude: continue
+            members = groups.get(val)
+            if members is None:
+                groups[val] = [item]
+            else:
+                members.append(item)
+
+    uniqs = sorted(groups) if sort else groups.keys()
+    return [(uniq, groups[uniq]) for uniq in uniqs]
 
 def membership(items, ranges, key=None):
     """
     Groups can be overlapping/nonexclusive and are based on custom ranges.
     This means that each item or value can be part of multiple group ranges. 
 
+    The items are only iterated once, so can also be a generator. The range endpoints are
+    sorted once, and each item is then looked up with a binary search, so that many
+    ranges over many items can be handled efficiently. 
+
     Args:
 
-    - **items**: The list of items or values to classify.
+    - **items**: The list of items or values to classify, or a `PreparedValues` of them.
     - **ranges**: A list of min-max tuples defining the upper and lower bounds of each group membership.
     - **key** (optional): Function used to extract value from each item, defaults to None and treats item itself as the value.
 
@@ -542,14 +1602,37 @@ def membership(items, ranges, key=None):
     - Iterates over the range groupings, each time yielding a 2-tuple of the group (its min-max value range) and a list of the
         items belonging to that group. 
     """
-    ###
-    if not key:
-        key = lambda x: x
-    ###
-    for _min,_max in ranges:
-        valitems = ((key(item),item) for item in items)
-        members = [item for val,item in valitems if val >= _min and val <= _max]
-        yield (_min,_max), members
+    ranges = [(_min,_max) for _min,_max in ranges]
+
+    # the sorted endpoints divide the value line into regions, alternating between the space
+    # below each endpoint and the endpoint itself, each covered by a fixed set of ranges
+    endpoints = sorted(set(itertools.chain.from_iterable(ranges)))
+    covers = [[] for _ in range(2 * len(endpoints) + 1)]
+    for i,(_min,_max) in enumerate(ranges):
+        first = 2 * bisect.bisect_left(endpoints, _min) + 1
+        last = 2 * bisect.bisect_left(endpoints, _max) + 1
+        for region in range(first, last+1):
+            covers[region].append(i)
+
+    # single pass over the items
+    groups = [[] for _ in ranges]
+    if isinstance(items, PreparedValues):
+        pairs = items.pairs()
+    elif key:
+        pairs = ((item,key(item)) for item in items)
+    else:
+        pairs = ((item,item) for item in items)
+    for item,val in pairs:
+        j = bisect.bisect_left(endpoints, val)
+        if j < len(endpoints) and endpoints[j] == val:
+            region = 2 * j + 1
+        else:
+            region = 2 * j
+        for i in covers[region]:
+            groups[i].append(item)
+
+    for valrange,members in zip(ranges, groups):
+        yield valrange, members
 
 def rescale(items, newmin, newmax, key=None, only=None, exclude=None):
     """
@@ -558,7 +1641,7 @@ def rescale(items, newmin, newmax, key=None, only=None, exclude=None):
 
     Args:
 
-    - **items**: The list of items or values to rescale.
+    - **items**: The list of items or values to rescale, or a `PreparedValues` of them.
     - **newmin**: The new minimum which the lowest item value will be rescaled to.
     - **newmax**: The new maximum which the highest item value will be rescaled to.
     - **key** (optional): Function used to extract value from each item, defaults to None and treats item itself as the value.
@@ -570,11 +1653,13 @@ def rescale(items, newmin, newmax, key=None, only=None, exclude=None):
     - Iterates over the input items, each time yielding a tuple of the original item along with the new rescaled value. 
     """
     # ensure values are numeric
+    rejected = [0]
     def forcenumber(val):
         try:
             val = float(val)
             return val
         except:
+            rejected[0] += 1
             return None
 
     # sort and get key
@@ -583,15 +1668,20 @@ def rescale(items, newmin, newmax, key=None, only=None, exclude=None):
     else:
         keywrap = forcenumber
 
-    pairs = ((item,keywrap(item)) for item in items)
-    pairs = ((item,val) for item,val in pairs if val is not None)
+    if isinstance(items, PreparedValues):
+        pairs = items.pairs()
+    else:
+        pairs = ((item,keywrap(item)) for item in items)
+        pairs = ((item,val) for item,val in pairs if val is not None)
 
     if only:
         pairs = ((item,val) for item,val in pairs if val in only)
     elif exclude:
         pairs = ((item,val) for item,val in pairs if val not in exclude)
 
-    items,values = zip(*pairs)
+    with _profile.stage("extract"):
+        items,values = zip(*pairs)
+    _profile.count("rejected", rejected[0])
 
     oldmin, oldmax = min(values), max(values)
 
@@ -622,6 +1712,124 @@ def rescale(items, newmin, newmax, key=None, only=None, exclude=None):
     for item,val in zip(items, values):
         nv = newval(val)
         yield item, nv
+
+def rescale_buffer(items, newmin, newmax, key=None, only=None, exclude=None, uint8=False, engine=None):
+    """
+    Rescales all item values to range from newmin to newmax in a single batch, like `rescale`, but returns
+    the new values packed in a compact buffer in the same order as the input items, eg for handing
+    colors or sizes directly to a renderer. 
+
+    Example:
+
+        >>> colors = classypie.rescale_buffer(values, (0,255,0), (255,0,0), uint8=True)
+        >>> colors[0:3] # rgb of the first value
+
+    Args:
+
+    - **items**: The list of items or values to rescale, or a `PreparedValues` of them.
+    - **newmin**: The new minimum which the lowest item value will be rescaled to. Either a single number or a sequence
+        of numbers, such as an rgb color, in which case each number is rescaled as a separate channel. 
+    - **newmax**: The new maximum which the highest item value will be rescaled to, of the same length as newmin.
+    - **key** (optional): Function used to extract value from each item, defaults to None and treats item itself as the value.
+    - **only** (optional): A list of values defining which values to include. 
+    - **exclude** (optional): A list of values defining which values to exclude. Does not apply if `only` is already specified.
+    - **uint8** (optional): If True, the new values are rounded and clamped to integers between 0 and 255. 
+    - **engine** (optional): Either 'python' or 'numpy'. Defaults to None, which uses numpy if it is installed
+        and pure Python otherwise.
+
+    Returns:
+
+    - With the python engine, an `array.array` with the channels of each item one after another, ie of length
+        n items times the number of channels. With the numpy engine, a numpy array of shape (n,) for single number
+        newmin/newmax or (n, channels) for sequences. The values are float64, or uint8 if uint8 is True.
+        Items that are not rescaled, due to non-numeric values, only or exclude, are given nan, or 0 if uint8 is True. 
+    """
+    # valid values and their positions in the input, or None if all items are valid
+    with _profile.stage("extract"):
+        positions = values = None
+        if isinstance(items, PreparedValues):
+            count = len(items.items)
+            numbered = zip(items.positions, items.values)
+        else:
+            items = list(items)
+            count = len(items)
+            if key is None and not only and not exclude:
+                # plain numbers can be packed directly
+                try:
+                    values = array.array('d', items)
+                except (TypeError, ValueError):
+                    pass
+            numbered = ((i,val) for (i,_),val in _valid_pairs(enumerate(items), lambda pair: key(pair[1]) if key else pair[1]))
+        if values is None:
+            if only:
+                numbered = ((i,val) for i,val in numbered if val in only)
+            elif exclude:
+                numbered = ((i,val) for i,val in numbered if val not in exclude)
+            positions = array.array('l')
+            values = array.array('d')
+            for i,val in numbered:
+                positions.append(i)
+                values.append(val)
+            if len(values) == count:
+                positions = None
+
+    if not values:
+        raise Exception("No valid values to rescale")
+    oldmin, oldmax = min(values), max(values)
+
+    # the new value of each channel is start + scale * (val - oldmin)
+    if hasattr(newmin, "__iter__") and hasattr(newmax, "__iter__"):
+        if len(newmin) != len(newmax):
+            raise Exception("If newmin/newmax are sequences they must both have the same length")
+        channels = list(zip(newmin, newmax))
+        single = False
+    else:
+        channels = [(newmin, newmax)]
+        single = True
+    if oldmin == oldmax:
+        # special case, only one value, return max newval
+        channels = [(to, 0.0) for _,to in channels]
+    else:
+        channels = [(fro, (to - fro) / float(oldmax - oldmin)) for fro,to in channels]
+    nchan = len(channels)
+
+    engine = _breaks.get_engine(engine)
+    with _profile.stage("classify"):
+        if engine == "numpy":
+            import numpy
+            if positions is None:
+                vals = numpy.asarray(values)
+            else:
+                vals = numpy.full(count, numpy.nan)
+                vals[numpy.asarray(positions, dtype=numpy.intp)] = numpy.asarray(values)
+            starts = numpy.array([start for start,_ in channels], dtype=numpy.float64)
+            scales = numpy.array([scale for _,scale in channels], dtype=numpy.float64)
+            out = starts + scales * (vals - oldmin)[:,None]
+            if uint8:
+                out = numpy.floor(numpy.clip(out, 0, 255) + 0.5)
+                out[numpy.isnan(out)] = 0
+                out = out.astype(numpy.uint8)
+            if single:
+                out = out[:,0]
+        else:
+            typecode = 'B' if uint8 else 'd'
+            out = array.array(typecode, [0 if uint8 else float('nan')]) * (count * nchan)
+            for c,(start,scale) in enumerate(channels):
+                if uint8 and 0 <= start <= 255 and 0 <= start + scale * (oldmax - oldmin) <= 255:
+                    # the channel range is already within 0-255, only needs rounding
+                    channel = array.array(typecode, [int(start + scale * (val - oldmin) + 0.5) for val in values])
+                elif uint8:
+                    channel = array.array(typecode, [int(min(max(start + scale * (val - oldmin), 0.0), 255.0) + 0.5)
+                                                     for val in values])
+                else:
+                    channel = array.array(typecode, [start + scale * (val - oldmin) for val in values])
+                if positions is None:
+                    # every item was rescaled, so fill the channel with a single strided assignment
+                    out[c::nchan] = channel
+                else:
+                    for i,newval in zip(positions, channel):
+                        out[i*nchan + c] = newval
+    return out
     
     
 
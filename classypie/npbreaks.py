@@ -0,0 +1,313 @@
+"""
+NumPy-vectorized versions of the breakpoint algorithms in breaks.py.
+Each function takes the same arguments and returns the same list of breaks
+as its pure-Python counterpart, but operates on contiguous float64 arrays.
+Only usable when NumPy is installed; use breaks.get_algorithm() to pick
+the engine automatically rather than importing this module directly.
+"""
+
+from __future__ import division
+import math
+import random
+
+import numpy
+
+from .breaks import _map, _sample_seeds, _headtail_weighted
+from .breaks import equal as _equal, log as _log, pretty as _pretty, stdev as _stdev, quantile as _quantile
+from .stream import FrequencyTable, QuantileSketch, Stats
+from . import profile as _profile
+
+
+
+def _asarray(values):
+    # contiguous float64 view of the input, copying only when needed
+    return numpy.ascontiguousarray(values, dtype=numpy.float64)
+
+def _tolist(arr):
+    # breaks are always returned as a list of python floats
+    return [float(v) for v in arr]
+
+
+# Algorithms for value breakpoints
+
+def histogram(values, **kwargs):
+    """
+    Alias for equal interval.
+    """
+    return equal(values, **kwargs)
+
+def equal(values, classes=5, interval=None, anchor=None, clip=True, start=None, end=None):
+    """
+    Equal interval algorithm using NumPy.
+    See breaks.equal.
+    """
+    if isinstance(values, (Stats,FrequencyTable)):
+        return _equal(values, classes=classes, interval=interval, anchor=anchor, clip=clip, start=start, end=end)
+
+    values = _asarray(values)
+
+    if len(values) == 1:
+        return _tolist(values) * 2
+
+    if start is None:
+        start = values.min()
+    if end is None:
+        end = values.max()
+
+    if interval:
+        # the interval loop only produces a handful of breaks
+        return _equal(None, interval=interval, anchor=anchor, clip=clip,
+                      start=float(start), end=float(end))
+
+    res = float(start) + numpy.arange(classes+1) * ((float(end) - float(start)) / classes)
+    return _tolist(res)
+
+def log(values, classes=5):
+    """
+    Log classification algorithm using NumPy.
+    See breaks.log.
+    """
+    if isinstance(values, (Stats,FrequencyTable)):
+        return _log(values, classes=classes)
+
+    values = _asarray(values)
+
+    if len(values) == 1:
+        return _tolist(values) * 2
+
+    # log10 is monotonic, so only the endpoints need to be transformed
+    minval = math.log10(float(values.min()) + 1)
+    maxval = math.log10(float(values.max()) + 1)
+    interval = (maxval-minval)/float(classes)
+    logbreaks = []
+    cur = minval
+    while cur <= maxval:
+        logbreaks.append(cur)
+        cur += interval
+
+    breaks = [(10**log)-1 for log in logbreaks]
+
+    return breaks
+
+def quantile(values, classes=5):
+    """
+    Quantile algorithm using NumPy.
+    See breaks.quantile. Expects sorted values, or at least the values at the
+    positions given by breaks.get_ranks in their sorted positions.
+    """
+    if isinstance(values, (QuantileSketch,FrequencyTable)):
+        return _quantile(values, classes)
+
+    values = _asarray(values)
+
+    if len(values) <= classes:
+        return _tolist(values) + [float(values[-1])]
+
+    n = len(values)
+    a = numpy.arange(classes) / float(classes) * n
+    aa = a.astype(numpy.intp)
+    r = a - aa
+    res = (1 - r) * values[aa] + r * values[aa+1]
+    return _tolist(res) + [float(values[n-1])]
+
+def pretty(values, classes=5, start=None, end=None):
+    """
+    R's pretty algorithm using NumPy to find the value range.
+    See breaks.pretty.
+    """
+    if isinstance(values, (Stats,FrequencyTable)):
+        return _pretty(values, classes=classes, start=start, end=end)
+
+    if values is not None:
+        values = _asarray(values)
+        if len(values) == 1:
+            return _tolist(values) * 2
+        if start is None:
+            start = float(values.min())
+        if end is None:
+            end = float(values.max())
+    return _pretty(None, classes=classes, start=start, end=end)
+
+def stdev(values, classes=5):
+    """
+    Standard deviation class interval algorithm using NumPy.
+    See breaks.stdev.
+    """
+    if isinstance(values, (Stats,FrequencyTable)):
+        return _stdev(values, classes=classes)
+
+    values = _asarray(values)
+
+    if len(values) <= classes:
+        values = numpy.sort(values)
+        return _tolist(values) + [float(values[-1])]
+
+    _min = float(values.min())
+    _max = float(values.max())
+    mean = float(values.mean())
+    sd2 = float(values.std())
+    res = _pretty(values=None, classes=5, start=(_min-mean)/sd2, end=(_max-mean)/sd2)
+    res2 = [(val*sd2)+mean for val in res]
+    return res2
+
+def natural(values, classes=5, maxsize=None, samples=3, workers=None, seed=None):
+    """
+    Jenks Optimal (Natural Breaks) algorithm using NumPy.
+    See breaks.natural. Expects sorted values, or a FrequencyTable.
+    """
+    if isinstance(values, FrequencyTable) and (values.count > classes or not values.integral):
+        uniq = numpy.frombuffer(values.values, dtype=numpy.float64)
+        counts = numpy.frombuffer(values.counts, dtype=numpy.float64)
+        if not (maxsize and values.count > maxsize):
+            if len(uniq) <= classes:
+                return _tolist(uniq) + [float(uniq[-1])]
+            return _jenks(uniq, counts, classes)
+        # the value at each rank is found in the cumulative counts
+        cumulative = numpy.cumsum(counts)
+        n = int(values.count)
+        at = lambda index: uniq[numpy.minimum(numpy.searchsorted(cumulative, index, side="right"), len(uniq)-1)]
+        top = uniq[-1]
+    else:
+        if isinstance(values, FrequencyTable):
+            values = values.expand()
+        values = _asarray(values)
+
+        if len(values) <= classes:
+            return _tolist(values) + [float(values[-1])]
+
+        n = len(values)
+        at = values.__getitem__
+        top = values[n-1]
+
+    if maxsize and n > maxsize:
+        randomsamples = []
+        for seed in _sample_seeds(samples, seed):
+            # values are sorted, so sorted sample indexes give a sorted sample
+            index = numpy.sort(random.Random(seed).sample(range(n), maxsize))
+            randomsample = at(index)
+
+            # include lower and higher bounds to ensure the whole range is considered
+            randomsample[0] = at(0)
+            randomsample[-1] = top
+            randomsamples.append((randomsample, classes))
+
+        allrandomsamples = _map(_jenks_runs, randomsamples, workers)
+
+        jenksbreaks = _tolist(numpy.mean(allrandomsamples, axis=0))
+
+    else:
+        jenksbreaks = _jenks_runs(values, classes)
+
+    return jenksbreaks
+
+def _jenks_runs(values, classes):
+    # collapse sorted values into weighted unique values, see breaks._jenks_runs
+    first = numpy.empty(len(values), dtype=bool)
+    first[0] = True
+    numpy.not_equal(values[1:], values[:-1], out=first[1:])
+    index = numpy.flatnonzero(first)
+    uniq = values[index]
+    counts = numpy.diff(numpy.append(index, len(values))).astype(numpy.float64)
+    if len(uniq) <= classes:
+        return _tolist(uniq) + [float(uniq[-1])]
+    return _jenks(uniq, counts, classes)
+
+def _jenks(values, weights, classes):
+    # Same divide-and-conquer dynamic program as breaks._jenks, but all
+    # subproblems at the same recursion depth are solved at once, so each
+    # row takes O(log n) vectorized passes over O(n) candidates.
+    n = len(values)
+    shifted = values - values[n // 2]
+    s0 = numpy.concatenate(([0.0], numpy.cumsum(weights)))
+    s1 = numpy.concatenate(([0.0], numpy.cumsum(weights * shifted)))
+    s2 = numpy.concatenate(([0.0], numpy.cumsum(weights * shifted * shifted)))
+
+    def cost(t, i):
+        a = s1[i] - s1[t]
+        return (s2[i] - s2[t]) - a * a / (s0[i] - s0[t])
+
+    # first row, a single class
+    i = numpy.arange(1, n+1)
+    prev = numpy.empty(n+1)
+    prev[0] = 0.0
+    prev[1:] = cost(numpy.zeros(n, dtype=numpy.intp), i)
+
+    starts = []
+    for j in range(2, classes+1):
+        cur = numpy.full(n+1, numpy.inf)
+        back = numpy.zeros(n+1, dtype=numpy.intp)
+        if j == classes:
+            lo = numpy.array([n])
+        else:
+            lo = numpy.array([j])
+        hi = numpy.array([n])
+        optlo = numpy.array([j-1])
+        opthi = numpy.array([n-1])
+        while len(lo):
+            mid = (lo + hi) // 2
+            lengths = numpy.minimum(mid-1, opthi) - optlo + 1
+            offsets = numpy.cumsum(lengths) - lengths
+            seg = numpy.repeat(numpy.arange(len(mid)), lengths)
+            t = optlo[seg] + numpy.arange(lengths.sum()) - offsets[seg]
+            _profile.count("natural_cells", len(t))
+            c = prev[t] + cost(t, mid[seg])
+            # leftmost argmin within each candidate segment
+            best = numpy.minimum.reduceat(c, offsets)
+            pos = numpy.where(c == best[seg], numpy.arange(len(c)), len(c))
+            bestt = t[numpy.minimum.reduceat(pos, offsets)]
+            cur[mid] = best
+            back[mid] = bestt
+            left = lo < mid
+            right = mid < hi
+            lo, hi, optlo, opthi = (numpy.concatenate((lo[left], mid[right]+1)),
+                                    numpy.concatenate((mid[left]-1, hi[right])),
+                                    numpy.concatenate((optlo[left], bestt[right])),
+                                    numpy.concatenate((bestt[left], opthi[right])))
+        starts.append(back)
+        prev = cur
+
+    kclass = [0.0] * (classes+1)
+    kclass[0] = float(values[0])
+    kclass[classes] = float(values[n-1])
+    i = n
+    for j in range(classes, 1, -1):
+        i = int(starts[j-2][i])
+        kclass[j-1] = float(values[i-1])
+    return kclass
+
+def headtail(values, classes=5):
+    """
+    Head tails classification scheme using NumPy, bisecting
+    the sorted values at each head mean.
+    See breaks.headtail. Expects sorted values, or a FrequencyTable.
+    """
+    if isinstance(values, FrequencyTable):
+        return _headtail_weighted(values.values, values.counts, values.count, classes)
+
+    values = _asarray(values)
+
+    if len(values) == 1:
+        return _tolist(values) * 2
+
+    n = len(values)
+    start = 0
+    breaks = []
+    m = float(values.mean())
+    nexthead = int(numpy.searchsorted(values, m, side="left"))
+    while nexthead - start > n - nexthead:
+        _profile.count("headtail_iterations")
+        breaks.append(m)
+        if n - nexthead > 1:
+            start = nexthead
+            m = float(values[start:].mean())
+            nexthead = int(numpy.searchsorted(values, m, side="left"))
+        else:
+            break
+
+    breaks.insert(0, float(values[0]))
+    breaks.append(float(values[-1]))
+
+    if classes and len(breaks) - 1 > classes:
+        del breaks[classes:-1]
+
+    return breaks
@@ -0,0 +1,143 @@
+"""
+Prepared value columns, for paying the cost of extracting, validating and
+sorting the item values only once when classifying the same items repeatedly.
+"""
+
+from __future__ import division
+import array
+import bisect
+
+from .stream import Stats
+
+
+
+class PreparedValues(object):
+    """
+    The numeric values of a list of items, extracted and validated once, along with a lazily
+    calculated sort order and summary statistics. Can be passed in place of the items to
+    `breaks`, `split`, `assign`, `unique`, `membership`, `rescale` and `Classifier`,
+    so that repeated operations on the same items skip the value extraction and sorting.
+
+    Non-numeric values are skipped, as in the other functions.
+
+    Attributes:
+
+    - items: The list of items.
+    - key: The function used to extract the value from each item, or None if the items are the values.
+    - values: An array('d') of the valid numeric values, in input order.
+    - positions: An array('l') of the index in items of each value.
+
+    Example:
+
+        >>> prepared = classypie.PreparedValues(features, key=lambda f: f["population"])
+        >>> breaks = classypie.breaks(prepared, "natural", classes=7)
+        >>> for valrange,members in classypie.split(prepared, breaks):
+        >>>     ...
+    """
+
+    def __init__(self, items, key=None):
+        """
+        Args:
+
+        - **items**: The list of items or values.
+        - **key** (optional): Function used to extract value from each item, defaults to None and treats item itself as the value.
+        """
+        self.items = items if isinstance(items, list) else list(items)
+        self.key = key
+        self.values = array.array('d')
+        self.positions = array.array('l')
+        for i,item in enumerate(self.items):
+            val = key(item) if key else item
+            try:
+                val = float(val)
+            except:
+                continue
+            self.values.append(val)
+            self.positions.append(i)
+        self._order = None
+        self._sorted_values = None
+        self._stats = None
+
+    def __repr__(self):
+        return "PreparedValues(items=%s, values=%s)" % (len(self.items), len(self.values))
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def order(self):
+        """
+        An array('l') of indexes into values that puts them in increasing order.
+        """
+        if self._order is None:
+            self._order = array.array('l', sorted(range(len(self.values)), key=self.values.__getitem__))
+        return self._order
+
+    @property
+    def sorted_values(self):
+        """
+        An array('d') of the values in increasing order. Should not be modified.
+        """
+        if self._sorted_values is None:
+            self._sorted_values = array.array('d', sorted(self.values))
+        return self._sorted_values
+
+    @property
+    def stats(self):
+        """
+        A `Stats` accumulator of the values.
+        """
+        if self._stats is None:
+            self._stats = Stats(self.values)
+        return self._stats
+
+    def select(self, exclude=None, minval=None, maxval=None):
+        """
+        Returns the sorted values, optionally filtered.
+
+        Args:
+
+        - **exclude** (optional): A list of values to exclude.
+        - **minval** (optional): Excludes values below this threshold.
+        - **maxval** (optional): Excludes values above this threshold.
+
+        Returns:
+
+        - An array('d') of the values in increasing order.
+        """
+        values = self.sorted_values
+        if minval is not None or maxval is not None:
+            # the values are sorted so the range can be sliced directly
+            start = bisect.bisect_left(values, minval) if minval is not None else 0
+            end = bisect.bisect_right(values, maxval) if maxval is not None else len(values)
+            values = values[start:end]
+        if exclude is not None:
+            if not isinstance(exclude, (list,tuple)): exclude = [exclude]
+            values = array.array('d', (val for val in values if val not in exclude))
+        return values
+
+    def pairs(self, exclude=None, minval=None, maxval=None, sort=False):
+        """
+        Iterates over the items with valid values, optionally filtered.
+
+        Args:
+
+        - **exclude** (optional): A list of values to exclude.
+        - **minval** (optional): Excludes values below this threshold.
+        - **maxval** (optional): Excludes values above this threshold.
+        - **sort** (optional): If True, iterates in order of increasing value, otherwise in input order.
+
+        Returns:
+
+        - Iterates over 2-tuples of each item and its value.
+        """
+        items,values,positions = self.items,self.values,self.positions
+        indexes = self.order if sort else range(len(values))
+        if exclude is not None:
+            if not isinstance(exclude, (list,tuple)): exclude = [exclude]
+        for i in indexes:
+            val = values[i]
+            if exclude is not None and val in exclude: continue
+            if minval is not None and val < minval: continue
+            if maxval is not None and val > maxval: continue
+            yield items[positions[i]], val
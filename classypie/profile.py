@@ -0,0 +1,178 @@
+"""
+Optional instrumentation of where the time goes when classifying, recording
+the duration of each processing stage along with item and algorithm counters.
+Recording only happens while a `Profile` is active, otherwise it costs nothing
+beyond a check for an active profile at the start of each stage.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from time import perf_counter as _clock
+except ImportError:
+    _clock = time.time
+
+
+
+_local = threading.local()
+
+def _active():
+    # the profiles that are currently active in this thread, innermost last
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+def _recording():
+    # the distinct active profiles, so that a profile entered more than once
+    # still records each event only once
+    profiles = []
+    for prof in _active():
+        if not any(prof is other for other in profiles):
+            profiles.append(prof)
+    return profiles
+
+class Profile(object):
+    """
+    Records per-stage durations and counters for all classification work done while it is active.
+    Profiles can be nested, in which case all active profiles record the same events.
+    A profile that is entered again while already active still records each event once.
+    Generator functions like `split` do their work while being iterated, so the profile
+    must still be active at that point.
+
+    The stages recorded are:
+
+    - extract: Extracting, validating and filtering the item values.
+    - sort: Sorting the values or items, or only as much as the algorithm needs, see `breaks.REQUIREMENTS`.
+    - algorithm: Calculating the breaks with the algorithm function.
+    - classify: Assigning the items to their classes. For single-pass operations such as
+        `split(sort=False)` this also includes extracting the values.
+    - classvalues: Looking up the class values of the items in `assign`.
+    - index: Building the sorted index used by `Classifier.add` and `Classifier.remove`.
+    - update, iterate, edit, assign, summarize: The total time of the `Classifier` operations, including the above stages.
+
+    The counters recorded are:
+
+    - items: Number of items whose values were extracted.
+    - rejected: Number of item values that were not numeric.
+    - filtered: Number of item values that were left out by exclude, minval or maxval.
+    - cache_hits, cache_misses: Number of breaks found and not found in a `BreaksCache`.
+    - natural_cells: Number of cells evaluated in the natural breaks dynamic program.
+    - headtail_iterations: Number of head/tail divisions done by the headtail algorithm.
+
+    Attributes:
+
+    - timings: Ordered dictionary of the total seconds spent in each stage.
+    - counters: Ordered dictionary of the total of each counter.
+    - callback: Function called with the `stats` dictionary each time the profile is exited, eg for
+        reporting to a metrics system.
+
+    Example:
+
+        >>> with classypie.Profile() as prof:
+        >>>     breaks = classypie.breaks(items, "natural", key=lambda f: f["population"])
+        >>> prof.stats
+        {'timings': {'extract': 0.012, 'sort': 0.004, 'algorithm': 0.09}, 'counters': {'items': 10000, 'rejected': 3, ...}}
+    """
+
+    def __init__(self, callback=None):
+        """
+        Args:
+
+        - **callback** (optional): Function called with the `stats` dictionary each time the profile is exited.
+        """
+        self.timings = OrderedDict()
+        self.counters = OrderedDict()
+        self.callback = callback
+
+    def __repr__(self):
+        return "Profile(timings=%s, counters=%s)" % (dict(self.timings), dict(self.counters))
+
+    def __enter__(self):
+        _active().append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        stack = _active()
+        # remove the last occurence, in case the same profile was entered more than once
+        for i in range(len(stack)-1, -1, -1):
+            if stack[i] is self:
+                del stack[i]
+                break
+        if self.callback:
+            self.callback(self.stats)
+
+    @property
+    def recording(self):
+        """
+        True if this profile is currently active in this thread.
+        """
+        return any(prof is self for prof in _active())
+
+    @property
+    def stats(self):
+        """
+        A dictionary with a copy of the timings and counters.
+        """
+        return {"timings": dict(self.timings), "counters": dict(self.counters)}
+
+    def add_time(self, stage, seconds):
+        """
+        Adds to the time spent in a stage.
+        """
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def count(self, name, n=1):
+        """
+        Adds to a counter.
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def clear(self):
+        """
+        Resets all timings and counters.
+        """
+        self.timings.clear()
+        self.counters.clear()
+
+
+class _Stage(object):
+    # times the enclosed block for all active profiles
+    __slots__ = ("name", "profiles", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.profiles = _recording()
+        if self.profiles:
+            self.start = _clock()
+
+    def __exit__(self, *exc_info):
+        if self.profiles:
+            seconds = _clock() - self.start
+            for prof in self.profiles:
+                prof.add_time(self.name, seconds)
+
+def stage(name):
+    """
+    Returns a context manager that records the time spent in the enclosed block as the named
+    stage, in all active profiles. Mostly used internally.
+    """
+    return _Stage(name)
+
+def count(name, n=1):
+    """
+    Adds to the named counter of all active profiles. Mostly used internally.
+    """
+    for prof in _recording():
+        prof.count(name, n)
+
+def active():
+    """
+    Returns True if any profile is active, for skipping the collection of expensive counters.
+    Mostly used internally.
+    """
+    return bool(_active())
@@ -0,0 +1,276 @@
+"""
+Classification of large raster grids, eg the bands of a satellite image or elevation model.
+The grid is processed one tile at a time, so that the memory use is bounded by the tile size
+rather than the size of the grid, and the cell values are never turned into one big list.
+"""
+
+from __future__ import division
+import array
+import itertools
+import random
+
+from .breaks import get_engine
+from .main import breaks as _calc_breaks, _find_index, _np_classnums, _STATS_ALGORITHMS
+from .stream import Stats
+from . import profile as _profile
+
+
+
+def raster_breaks(grid, algorithm, shape=None, nodata=None, sample=100000, tilesize=512, seed=None, engine=None, **kwargs):
+    """
+    Calculates the break points of the cell values of a raster grid, in a single pass over its tiles.
+
+    The equal, histogram, log, pretty and stdev algorithms are calculated exactly from running statistics.
+    Other algorithms are calculated from a random sample of the cells, which always includes the
+    minimum and maximum value so that the breaks cover all the cells.
+
+    Args:
+
+    - **grid**: The raster grid, either a 2-D numpy array (including a memory-mapped one), a sequence of rows,
+        or a flat sequence or buffer of the cell values in row-major order along with the shape argument.
+    - **algorithm**: Name of the classification algorithm to use, see `classypie.breaks`.
+    - **shape** (optional): A (rows, columns) tuple, required if the grid is flat.
+    - **nodata** (optional): A value or list of values for cells that have no data, which are ignored. Nan cells
+        are always ignored.
+    - **sample** (optional): The number of cells to sample for algorithms that need the sorted values.
+        If None, or if the grid has fewer cells, all the cells are used. Defaults to 100000.
+    - **tilesize** (optional): The number of rows and columns of each tile. Defaults to 512.
+    - **seed** (optional): Seed for the random sample, for reproducible results.
+    - **engine** (optional): Either 'python' or 'numpy'. Defaults to None, which uses numpy if it is installed
+        and pure Python otherwise.
+    - **kwargs** (optional): Any remaining kwargs, such as classes or extrabreaks, are passed to `classypie.breaks`.
+
+    Returns:
+
+    - List of break points calculated for this algorithm in increasing order.
+    """
+    engine = get_engine(engine)
+    rows,cols = _shape(grid, shape)
+    total = rows * cols
+
+    if algorithm in _STATS_ALGORITHMS:
+        # single exact pass
+        stats = Stats()
+        with _profile.stage("extract"):
+            for window in _tiles(grid, rows, cols, tilesize):
+                vals = _valid(window, nodata, engine)
+                if engine == "numpy":
+                    stats.merge(_np_stats(vals))
+                else:
+                    stats.extend(vals)
+        if not stats.count:
+            raise Exception("The raster grid has no valid values")
+        return _calc_breaks(stats, algorithm, engine=engine, **kwargs)
+
+    # random sample of the valid cells, along with the exact min and max
+    fraction = 1.0 if sample is None or total <= sample else sample / float(total)
+    rand = random.Random(seed)
+    values = []
+    minval = maxval = None
+    wanted = taken = 0
+    with _profile.stage("extract"):
+        for window in _tiles(grid, rows, cols, tilesize):
+            vals = _valid(window, nodata, engine)
+            if not len(vals):
+                continue
+            # the min and max are always needed so that the breaks cover all cells
+            if engine == "numpy":
+                lo,hi = float(vals.min()),float(vals.max())
+            else:
+                lo,hi = min(vals),max(vals)
+            minval = lo if minval is None else min(minval, lo)
+            maxval = hi if maxval is None else max(maxval, hi)
+            if fraction < 1:
+                wanted += fraction * len(vals)
+                k = min(int(wanted) - taken, len(vals))
+                taken += k
+                index = sorted(rand.sample(range(len(vals)), k))
+                if engine == "numpy":
+                    vals = vals[index]
+                else:
+                    vals = [vals[i] for i in index]
+            values.append(vals)
+    if minval is None:
+        raise Exception("The raster grid has no valid values")
+    if fraction < 1:
+        values.append([minval, maxval])
+    if engine == "numpy":
+        import numpy
+        values = numpy.concatenate(values)
+    else:
+        values = list(itertools.chain.from_iterable(values))
+    return _calc_breaks(values, algorithm, engine=engine, **kwargs)
+
+def classify_raster(grid, breaks, shape=None, nodata=None, out=None, tilesize=512, engine=None, **kwargs):
+    """
+    Classifies each cell of a raster grid, writing the class numbers to an output grid one tile
+    at a time. Uses the same boundary rules as `classypie.find_class`.
+
+    Example:
+
+        >>> band = numpy.load("elevation.npy", mmap_mode="r")
+        >>> classgrid,breaks = classypie.classify_raster(band, "natural", classes=7, nodata=-9999)
+
+    Args:
+
+    - **grid**: The raster grid, either a 2-D numpy array (including a memory-mapped one), a sequence of rows,
+        or a flat sequence or buffer of the cell values in row-major order along with the shape argument.
+    - **breaks**: List of custom break values, or the name of the algorithm to use, in which case the breaks
+        are calculated with `raster_breaks`.
+    - **shape** (optional): A (rows, columns) tuple, required if the grid is flat.
+    - **nodata** (optional): A value or list of values for cells that have no data, which are given class 0.
+        Nan cells are always given class 0.
+    - **out** (optional): The grid to write the class numbers to, either a 2-D numpy array of the same shape
+        (such as a writable memory-mapped file) or a flat writable sequence of rows times columns. If not given,
+        a new uint16 numpy array is created with the numpy engine, and a flat `array.array('H')` with the python engine.
+    - **tilesize** (optional): The number of rows and columns of each tile. Defaults to 512.
+    - **engine** (optional): Either 'python' or 'numpy'. Defaults to None, which uses numpy if it is installed
+        and pure Python otherwise.
+    - **kwargs** (optional): If an algorithm name is given, any remaining kwargs are passed to `raster_breaks`.
+
+    Returns:
+
+    - A 2-tuple of the output grid of class numbers, where 1 is the first class and 0 means the cell was nodata
+        or outside the breaks, and the list of breaks.
+    """
+    engine = get_engine(engine)
+    rows,cols = _shape(grid, shape)
+
+    if isinstance(breaks, (list,tuple)):
+        breaks = list(breaks)
+    else:
+        breaks = raster_breaks(grid, breaks, shape=(rows,cols), nodata=nodata, tilesize=tilesize, engine=engine, **kwargs)
+    floatbreaks = [float(brk) for brk in breaks]
+    if len(floatbreaks)-1 > 65535:
+        raise Exception("Cannot classify more than 65535 classes")
+
+    if out is None:
+        if engine == "numpy":
+            import numpy
+            out = numpy.zeros((rows,cols), dtype=numpy.uint16)
+        else:
+            out = array.array('H', [0]) * (rows * cols)
+
+    nodata = _nodata_list(nodata)
+    with _profile.stage("classify"):
+        for (r0,r1,c0,c1),window in _tiles(grid, rows, cols, tilesize, bounds=True):
+            if engine == "numpy":
+                vals = _np_cells(window).reshape(r1-r0, c1-c0)
+                classnums = _np_classnums(vals, floatbreaks)
+                for val in nodata:
+                    classnums[vals == val] = 0
+            else:
+                classnums = array.array('H', [0]) * ((r1-r0) * (c1-c0))
+                for i,val in enumerate(_cells(window)):
+                    # nan is outside all breaks
+                    if val not in nodata:
+                        index = _find_index(float(val), floatbreaks)
+                        if index is not None:
+                            classnums[i] = index + 1
+            _write(out, cols, r0, r1, c0, c1, classnums)
+
+    return out, breaks
+
+def _shape(grid, shape):
+    # the number of rows and columns of the grid
+    if shape is not None:
+        return tuple(shape)
+    if getattr(grid, "ndim", None) == 2:
+        return grid.shape
+    try:
+        return len(grid), len(grid[0])
+    except TypeError:
+        raise Exception("The shape argument is required for flat raster grids")
+
+def _tiles(grid, rows, cols, tilesize, bounds=False):
+    # yields the cell values of each tile in row-major order, a 2-D numpy view for numpy grids
+    # and an iterable otherwise, optionally along with the tile bounds
+    ndim = getattr(grid, "ndim", None)
+    if ndim is not None and not hasattr(grid, "reshape"):
+        # memoryviews and other buffers cannot be sliced in two dimensions, read them as flat
+        if ndim > 1:
+            grid = grid.cast("B").cast(grid.format)
+        ndim = None
+        rowwise = False
+    else:
+        if ndim == 1:
+            grid = grid.reshape(rows, cols)
+            ndim = 2
+        rowwise = ndim is None and hasattr(grid[0], "__getitem__")
+    for r0 in range(0, rows, tilesize):
+        r1 = min(r0 + tilesize, rows)
+        for c0 in range(0, cols, tilesize):
+            c1 = min(c0 + tilesize, cols)
+            if ndim == 2:
+                window = grid[r0:r1, c0:c1]
+            elif rowwise:
+                # sequence of rows
+                window = itertools.chain.from_iterable(row[c0:c1] for row in grid[r0:r1])
+            else:
+                # flat sequence
+                window = itertools.chain.from_iterable(grid[r*cols+c0 : r*cols+c1] for r in range(r0, r1))
+            if bounds:
+                yield (r0,r1,c0,c1), window
+            else:
+                yield window
+
+def _nodata_list(nodata):
+    if nodata is None:
+        return []
+    elif isinstance(nodata, (list,tuple)):
+        return [float(val) for val in nodata]
+    else:
+        return [float(nodata)]
+
+def _cells(window):
+    # iterable of the cell values of a tile
+    if hasattr(window, "ravel"):
+        return window.ravel().tolist()
+    return window
+
+def _np_cells(window):
+    # flat float64 numpy array of the cell values of a tile
+    import numpy
+    if hasattr(window, "ravel"):
+        return numpy.asarray(window, dtype=numpy.float64).ravel()
+    return numpy.fromiter(window, dtype=numpy.float64)
+
+def _valid(window, nodata, engine):
+    # the cell values of a tile that are not nan or nodata
+    nodata = _nodata_list(nodata)
+    if engine == "numpy":
+        import numpy
+        vals = _np_cells(window)
+        mask = ~numpy.isnan(vals)
+        for val in nodata:
+            mask &= vals != val
+        return vals[mask]
+    else:
+        return [float(val) for val in _cells(window) if val == val and val not in nodata]
+
+def _np_stats(vals):
+    # Stats of a numpy array, calculated in a vectorized way
+    stats = Stats()
+    if len(vals):
+        mean = float(vals.mean())
+        stats.count = len(vals)
+        stats.min = float(vals.min())
+        stats.max = float(vals.max())
+        stats._mean = mean
+        stats._m2 = float(((vals - mean) ** 2).sum())
+    return stats
+
+def _write(out, cols, r0, r1, c0, c1, classnums):
+    # writes the class numbers of a tile to the output grid
+    if getattr(out, "ndim", None) == 2:
+        if not hasattr(classnums, "reshape"):
+            import numpy
+            classnums = numpy.frombuffer(classnums, dtype=numpy.uint16)
+        out[r0:r1, c0:c1] = classnums.reshape(r1-r0, c1-c0)
+        return
+    width = c1 - c0
+    if hasattr(classnums, "ravel"):
+        classnums = array.array('H', classnums.ravel().tolist())
+    for r in range(r0, r1):
+        start = (r - r0) * width
+        out[r*cols+c0 : r*cols+c1] = classnums[start : start+width]
@@ -0,0 +1,512 @@
+"""
+Single-pass summaries of value streams, for calculating breaks without
+materializing and sorting the full dataset. Summaries can be built
+separately for different chunks or partitions of the data and then merged.
+"""
+
+from __future__ import division
+import array
+import bisect
+import math
+import random
+
+
+
+class QuantileSketch(object):
+    """
+    Mergeable sketch of a stream of values, answering approximate quantile queries
+    in bounded memory (KLL sketch, Karnin, Lang and Liberty 2016).
+    The minimum and maximum values are kept exactly.
+
+    Attributes:
+
+    - k: The size of the largest compactor, determining the accuracy.
+    - count: Total number of values added to the sketch.
+    - min: The exact minimum value, or None if empty.
+    - max: The exact maximum value, or None if empty.
+
+    Example:
+
+        >>> sketch = classypie.QuantileSketch(error=0.005)
+        >>> sketch.extend(chunk1)
+        >>> other = classypie.QuantileSketch(error=0.005)
+        >>> other.extend(chunk2)
+        >>> sketch.merge(other)
+        >>> classypie.breaks(sketch, "quantile", classes=5)
+    """
+
+    def __init__(self, error=0.01, maxsize=None, seed=None):
+        """
+        Args:
+
+        - **error** (optional): The approximate rank error to allow, as a fraction of the number of values.
+            Defaults to 0.01, ie a returned 50th percentile has a rank between the 49th and 51st percentile.
+        - **maxsize** (optional): Caps the number of values held in memory, lowering the accuracy if needed.
+            Since each level of the sketch holds at least one value, the cap is only exceeded if it is
+            below the number of levels, which grows with log2 of the count.
+        - **seed** (optional): Seed for the random compaction choices, for reproducible results.
+        """
+        # the rank error of a kll sketch is about 1.65/k and it holds about 3k values
+        k = int(math.ceil(1.65 / error))
+        if maxsize:
+            # small caps lower the accuracy rather than being exceeded
+            self.k = max(min(k, maxsize // 3), 2)
+        else:
+            self.k = max(k, 8)
+        self.maxsize = maxsize
+        self.count = 0
+        self.min = None
+        self.max = None
+        self._compactors = []
+        self._capacity = 0
+        self._size = 0
+        self._random = random.Random(seed)
+        self._grow()
+
+    def __repr__(self):
+        return "QuantileSketch(count=%s, k=%s, retained=%s)" % (self.count, self.k, self._size)
+
+    def __len__(self):
+        return self.count
+
+    def _grow(self):
+        self._compactors.append([])
+        self._capacity = sum(self._levelcapacity(h) for h in range(len(self._compactors)))
+
+    def _levelcapacity(self, h):
+        # lower levels get geometrically smaller capacities
+        depth = len(self._compactors) - h - 1
+        return int(math.ceil((2/3.0)**depth * self.k)) + 1
+
+    def _full(self):
+        return self._size >= self._capacity or (self.maxsize and self._size > self.maxsize)
+
+    def _compress(self):
+        # compacts the lowest level that is over its capacity, or if only the maxsize is
+        # exceeded, the lowest level with values to compact. Returns False if none could be.
+        for h,compactor in enumerate(self._compactors):
+            if len(compactor) >= self._levelcapacity(h):
+                break
+        else:
+            for h,compactor in enumerate(self._compactors):
+                if len(compactor) >= 2:
+                    break
+            else:
+                return False
+        if h+1 >= len(self._compactors):
+            self._grow()
+        # keep every other value, at double the weight, from a random offset
+        compactor.sort()
+        odd = len(compactor) % 2
+        offset = self._random.randint(0, 1)
+        self._compactors[h+1].extend(compactor[offset:len(compactor)-odd:2])
+        del compactor[:len(compactor)-odd]
+        self._size = sum(len(comp) for comp in self._compactors)
+        return True
+
+    def add(self, value):
+        """
+        Adds a single value to the sketch.
+        """
+        if self.count == 0:
+            self.min = self.max = value
+        elif value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+        self.count += 1
+        self._compactors[0].append(value)
+        self._size += 1
+        while self._full() and self._compress():
+            pass
+
+    def extend(self, values):
+        """
+        Adds all values from an iterable to the sketch.
+        """
+        add = self.add
+        for value in values:
+            add(value)
+
+    def merge(self, other):
+        """
+        Merges another sketch into this one, so that this sketch represents the values of both.
+
+        Returns:
+
+        - This sketch, to allow chaining.
+        """
+        if other.count == 0:
+            return self
+        while len(self._compactors) < len(other._compactors):
+            self._grow()
+        for h,compactor in enumerate(other._compactors):
+            self._compactors[h].extend(compactor)
+        if self.count == 0:
+            self.min, self.max = other.min, other.max
+        else:
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        self.count += other.count
+        self._size = sum(len(comp) for comp in self._compactors)
+        while self._full() and self._compress():
+            pass
+        return self
+
+    def weighted_values(self):
+        """
+        Returns the retained values in sorted order as a list of (value, weight) tuples,
+        where each weight is the number of original values it represents.
+        """
+        pairs = []
+        for h,compactor in enumerate(self._compactors):
+            weight = 2**h
+            pairs.extend((value,weight) for value in compactor)
+        pairs.sort()
+        return pairs
+
+    def quantiles(self, fractions):
+        """
+        Returns the approximate values at each fraction (between 0 and 1) of the
+        cumulative distribution. Fraction 0 and 1 return the exact min and max.
+        """
+        if self.count == 0:
+            raise Exception("Cannot calculate quantiles of an empty sketch")
+        pairs = self.weighted_values()
+        total = sum(weight for _,weight in pairs)
+        results = []
+        for q in fractions:
+            if q <= 0:
+                results.append(self.min)
+                continue
+            elif q >= 1:
+                results.append(self.max)
+                continue
+            rank = q * total
+            cum = 0
+            for value,weight in pairs:
+                cum += weight
+                if cum > rank:
+                    break
+            results.append(value)
+        return results
+
+    def quantile(self, fraction):
+        """
+        Returns the approximate value at a fraction (between 0 and 1) of the cumulative distribution.
+        """
+        return self.quantiles([fraction])[0]
+
+
+
+class Stats(object):
+    """
+    Mergeable single-pass accumulator of the count, min, max, mean and variance of a stream
+    of values, using Welford's algorithm. Holds O(1) memory regardless of the number of values.
+    Can be passed in place of the values to the equal, log, pretty and stdev break algorithms.
+
+    Attributes:
+
+    - count: Number of values added.
+    - min: The minimum value, or None if empty.
+    - max: The maximum value, or None if empty.
+    - mean: The mean value, or None if empty.
+    - variance: The population variance, or None if empty.
+    - stdev: The population standard deviation, or None if empty.
+
+    Example:
+
+        >>> stats = classypie.Stats()
+        >>> for chunk in chunks:
+        >>>     stats.extend(chunk)
+        >>> classypie.breaks(stats, "equal", classes=5)
+    """
+
+    def __init__(self, values=None):
+        """
+        Args:
+
+        - **values** (optional): An iterable of initial values to add. 
+        """
+        self.count = 0
+        self.min = None
+        self.max = None
+        self._mean = 0.0
+        self._m2 = 0.0 # sum of squared deviations from the mean
+        if values is not None:
+            self.extend(values)
+
+    def __repr__(self):
+        return "Stats(count=%s, min=%s, max=%s, mean=%s, stdev=%s)" % (self.count, self.min, self.max, self.mean, self.stdev)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def mean(self):
+        if self.count:
+            return self._mean
+
+    @property
+    def variance(self):
+        if self.count:
+            return self._m2 / self.count
+
+    @property
+    def stdev(self):
+        if self.count:
+            return math.sqrt(self.variance)
+
+    def add(self, value):
+        """
+        Adds a single value.
+        """
+        if self.count == 0:
+            self.min = self.max = value
+        elif value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+        self.count += 1
+        delta = value - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (value - self._mean)
+
+    def remove(self, value):
+        """
+        Removes a single previously added value, updating the count, mean and variance.
+        The min and max cannot be known without the remaining values, so are left
+        unchanged and should be reset by the caller if needed. 
+        """
+        if self.count <= 1:
+            self.count = 0
+            self.min = self.max = None
+            self._mean = self._m2 = 0.0
+            return
+        delta = value - self._mean
+        self._mean -= delta / (self.count - 1)
+        self._m2 -= delta * (value - self._mean)
+        self._m2 = max(self._m2, 0.0)
+        self.count -= 1
+
+    def extend(self, values):
+        """
+        Adds all values from an iterable.
+        """
+        add = self.add
+        for value in values:
+            add(value)
+
+    def merge(self, other):
+        """
+        Merges the statistics of another accumulator into this one, eg from another
+        chunk of data or another process.
+
+        Returns:
+
+        - This accumulator, to allow chaining.
+        """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.min, self.max = other.count, other.min, other.max
+            self._mean, self._m2 = other._mean, other._m2
+            return self
+        count = self.count + other.count
+        delta = other._mean - self._mean
+        self._mean += delta * other.count / count
+        self._m2 += other._m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+
+
+class FrequencyTable(object):
+    """
+    Mergeable table of the distinct values of a dataset and the number of times each occurs,
+    such as a pre-computed histogram of raster cell values. Can be passed in place of the items
+    to `breaks` and `split`, where all the algorithms give the same breaks as for the expanded
+    values, but in time proportional to the number of distinct values rather than the number of values. 
+
+    Non-numeric and nan values are skipped. The counts may also be fractional weights.
+
+    Attributes:
+
+    - count: Total count of all the values.
+    - values: An array('d') of the distinct values in increasing order. Should not be modified.
+    - counts: An array('d') of the count of each of the distinct values. Should not be modified.
+    - min: The minimum value, or None if empty.
+    - max: The maximum value, or None if empty.
+
+    Example:
+
+        >>> table = classypie.FrequencyTable([0, 1, 2, 3], [120000, 5000, 310, 2])
+        >>> classypie.breaks(table, "natural", classes=3)
+        >>> table = classypie.FrequencyTable(histogram.items())
+        >>> for valrange,members in classypie.split(table, "quantile", classes=4):
+        >>>     ...
+    """
+
+    def __init__(self, values=None, counts=None):
+        """
+        Args:
+
+        - **values** (optional): A sequence of values, or if counts is not given, an iterable of (value, count) tuples.
+        - **counts** (optional): A sequence of the count of each value, in the same order as values. 
+        """
+        self.count = 0
+        self._counts = {}
+        self._sorted = None
+        self._stats = None
+        if values is not None:
+            if counts is None:
+                self.update(values)
+            else:
+                self.update(zip(values, counts))
+
+    def __repr__(self):
+        return "FrequencyTable(values=%s, count=%s)" % (len(self), self.count)
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __iter__(self):
+        return iter(zip(self.values, self.counts))
+
+    def _prepare(self):
+        # the sorted distinct values and their counts, along with the cumulative counts
+        if self._sorted is None:
+            values = array.array('d', sorted(self._counts))
+            counts = array.array('d', [self._counts[val] for val in values])
+            cumulative = array.array('d', counts)
+            total = 0
+            for i,cnt in enumerate(counts):
+                total += cnt
+                cumulative[i] = total
+            self._sorted = values, counts, cumulative
+        return self._sorted
+
+    @property
+    def values(self):
+        return self._prepare()[0]
+
+    @property
+    def counts(self):
+        return self._prepare()[1]
+
+    @property
+    def min(self):
+        if self._counts:
+            return self.values[0]
+
+    @property
+    def max(self):
+        if self._counts:
+            return self.values[-1]
+
+    @property
+    def integral(self):
+        """
+        True if all the counts are whole numbers, so that the table can be expanded.
+        """
+        return all(cnt == int(cnt) for cnt in self._counts.values())
+
+    @property
+    def stats(self):
+        """
+        A `Stats` accumulator of the expanded values.
+        """
+        if self._stats is None:
+            stats = Stats()
+            if self._counts:
+                values,counts = self.values,self.counts
+                mean = math.fsum(val * cnt for val,cnt in zip(values, counts)) / self.count
+                stats.count = self.count
+                stats.min = values[0]
+                stats.max = values[-1]
+                stats._mean = mean
+                stats._m2 = math.fsum((val - mean) * (val - mean) * cnt for val,cnt in zip(values, counts))
+            self._stats = stats
+        return self._stats
+
+    def add(self, value, count=1):
+        """
+        Adds a value the given number of times.
+        """
+        try:
+            value = float(value)
+        except:
+            return
+        if count < 0:
+            raise Exception("Frequency table counts cannot be negative")
+        if not count or value != value:
+            return
+        self._counts[value] = self._counts.get(value, 0) + count
+        self.count += count
+        self._sorted = self._stats = None
+
+    def extend(self, values):
+        """
+        Adds each value from an iterable once.
+        """
+        add = self.add
+        for value in values:
+            add(value)
+
+    def update(self, pairs):
+        """
+        Adds the counts from an iterable of (value, count) tuples.
+        """
+        add = self.add
+        for value,count in pairs:
+            add(value, count)
+
+    def merge(self, other):
+        """
+        Adds the counts of another frequency table to this one, eg from another chunk of data.
+
+        Returns:
+
+        - This table, to allow chaining.
+        """
+        self.update(other._counts.items())
+        return self
+
+    def value_at(self, rank):
+        """
+        Returns the value at a position (starting at 0) of the expanded values in increasing order,
+        found by binary search of the cumulative counts.
+        """
+        values,counts,cumulative = self._prepare()
+        i = bisect.bisect_right(cumulative, rank)
+        return values[min(i, len(values)-1)]
+
+    def expand(self):
+        """
+        Returns a list of all the values in increasing order, each repeated by its count.
+        Only meant for small tables whose counts are whole numbers (see integral), since
+        fractional counts are rounded down.
+        """
+        return [val for val,cnt in zip(self.values, self.counts) for _ in range(int(cnt))]
+
+    def select(self, exclude=None, minval=None, maxval=None):
+        """
+        Returns a new frequency table of only some of the values, or this table if there are no filters.
+
+        Args:
+
+        - **exclude** (optional): A list of values to exclude.
+        - **minval** (optional): Excludes values below this threshold.
+        - **maxval** (optional): Excludes values above this threshold.
+        """
+        if exclude is None and minval is None and maxval is None:
+            return self
+        values,counts,_ = self._prepare()
+        start = bisect.bisect_left(values, minval) if minval is not None else 0
+        end = bisect.bisect_right(values, maxval) if maxval is not None else len(values)
+        if exclude is not None:
+            if not isinstance(exclude, (list,tuple)): exclude = [exclude]
+        return FrequencyTable((pair for pair in zip(values[start:end], counts[start:end])
+                               if exclude is None or pair[0] not in exclude))
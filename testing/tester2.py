@@ -3,22 +3,19 @@ import classypie as cp
 
 items = [v**2 for v in range(100)]
 
-##cfier = cp.MultiClassifier(items)
-##cfier.add_classification("equaltest",
-##                       breaks="equal",
-##                       fromval=1,
-##                       toval=10)
-##cfier.add_classification("naturaltest",
-##                       breaks="natural",
-##                       fromval=1,
-##                       toval=10)
-##cfier.add_classification("headtailtest",
-##                       breaks="headtail",
-##                       fromval=1,
-##                       toval=10)
-##
-##for item,info in cfier:
-##    print item,info
+cfier = cp.MultiClassifier(items)
+cfier.add_classification("equaltest",
+                       breaks="equal",
+                       classvalues=[1,10])
+cfier.add_classification("naturaltest",
+                       breaks="natural",
+                       classvalues=[1,10])
+cfier.add_classification("headtailtest",
+                       breaks="headtail",
+                       classvalues=[1,10])
+
+for item,info in cfier:
+    print item,info
 
 
 cfier = cp.Classifier(items,